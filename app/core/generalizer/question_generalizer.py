@@ -1,6 +1,12 @@
-from typing import List
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+import contextvars
+from typing import List, Optional, Tuple
 
 from app.core.llm.llm_client import LlmClient
+from app.core.llm.metrics import llm_stage
+from app.core.llm.tagged_lines import KEYWORDS_TO_REMOVE, TAGGED_LINE_PATTERN, clean_line
+from app.core.validator.near_duplicate_index import NearDuplicateIndex
 
 CONTENT_TEMPLATE = """
 Original Query: {query}
@@ -23,19 +29,43 @@ Below, I will provide some sentences. For each statement, please generate 10 gen
 """  # noqa: E501
 
 
+BATCH_CONTENT_TEMPLATE = """
+[{id}] Original Query: {query}
+[{id}] Original Question: {question}
+"""
+
+BATCH_PROMPT = """
+I hope you can imitate the tone of a graph database user to further generalize the question statements I provide without changing their original meaning. The generalized expressions should align with the meaning of the provided query and can be reformulated as questions or statements. Here is an example:
+[1] Original Query: MATCH (n:Person {{name:'Vanessa Redgrave'}})-[:HAS_CHILD*1..]-(n) RETURN n
+[1] Original Question: Who are Roy Redgrave's second generation and all their descendants?
+You should provide:
+[1] How to find all descendants of Roy Redgrave?
+[1] Find all descendants of Roy Redgrave.
+[1] Output all descendants of Roy Redgrave.
+[1] Who are all descendants of Roy Redgrave?
+[1] Find all descendants of a person named Roy Redgrave in the database.
+[1] Who are the descendants of Roy Redgrave?
+
+Below, I will provide several statements, each tagged with an id like [1]. For each statement, please generate {per_item} generalized results in sequence. Start every result with the id of its statement and do not skip any statement. Results should be separated by line breaks.
+"""  # noqa: E501
+
+
 class QuestionGeneralizer:
-    def __init__(self, llm_client: LlmClient):
+    def __init__(self, llm_client: LlmClient, dedup_index: Optional[NearDuplicateIndex] = None):
         self.llm_client = llm_client
-        self.keywords_to_remove = [
-            "Cypher: ",
-            "   **Translation:**",
-            "**",
-            "    -",
-            "`",
-            ". ",
-        ]
+        # generalized questions that are near duplicates of admitted ones, or of each
+        # other within one call, are dropped; questions are only admitted through admit
+        # once the caller has saved them
+        self.dedup_index = dedup_index
+        self.keywords_to_remove = list(KEYWORDS_TO_REMOVE)
 
+    @llm_stage("question_generalization")
     def generalize(self, query: str, question: str) -> List[str]:
+        return self.deduplicate(self._generalize_single(query, question), self._run_index())
+
+    def _generalize_single(
+        self, query: str, question: str, per_item: Optional[int] = None
+    ) -> List[str]:
         content = CONTENT_TEMPLATE.format(query=query, question=question)
         # 2. gen massages
         messages = [
@@ -50,25 +80,144 @@ class QuestionGeneralizer:
 
         # 4. postprocess and save
         if response != "":
-            generalized_question_list = self.post_process(response)
-            return generalized_question_list
+            # the prompt asks for 10 questions, keep at most per_item of them
+            return self.post_process(response)[:per_item]
         else:
             return []
 
+    @llm_stage("question_generalization")
+    def generalize_batch(
+        self,
+        pairs: List[Tuple[str, str]],
+        per_item: int = 10,
+        pairs_per_prompt: int = 10,
+        max_concurrency: int = 8,
+        batch_size: int = 1,
+    ) -> List[List[str]]:
+        """Generalize many (query, question) pairs with id-tagged prompts of several pairs.
+
+        Prompts are passed to the LLM client batch_size at a time and max_concurrency
+        batches are in flight. A local model generates a batch in one forward pass, remote
+        platforms answer its prompts one after another, so keep batch_size at 1 for them.
+        Pairs missing from a response are generalized again on their own in the same pool
+        as soon as their batch completes.
+
+        Args:
+            pairs: (query, question) pairs.
+            per_item: Number of generalized questions requested per pair.
+            pairs_per_prompt: Number of pairs sharing one prompt.
+            max_concurrency: Number of batched calls in flight.
+            batch_size: Number of prompts in one batched call.
+        Returns:
+            The generalized questions of every pair, in the order of pairs.
+        """
+        groups = [
+            (start, pairs[start : start + pairs_per_prompt])
+            for start in range(0, len(pairs), pairs_per_prompt)
+        ]
+        batches = [groups[i : i + batch_size] for i in range(0, len(groups), batch_size)]
+        results: List = [None] * len(pairs)
+        with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+            # worker threads keep the llm_stage of the caller
+            futures = {
+                executor.submit(
+                    contextvars.copy_context().run,
+                    self.llm_client.call_with_messages_batch,
+                    [self.build_batch_messages(group, per_item) for _, group in batch],
+                    batch_size=batch_size,
+                ): batch
+                for batch in batches
+            }
+            for future in as_completed(futures):
+                for (start, group), response in zip(futures[future], future.result()):
+                    grouped = self.post_process_batch(response or "", len(group), per_item)
+                    for index, (query, question) in enumerate(group, 1):
+                        if grouped.get(index):
+                            results[start + index - 1] = grouped[index]
+                        else:
+                            results[start + index - 1] = executor.submit(
+                                contextvars.copy_context().run,
+                                self._generalize_single,
+                                query,
+                                question,
+                                per_item,
+                            )
+
+        # deduplicate in the order of pairs, so the outcome does not depend on timing
+        seen = self._run_index()
+        return [
+            self.deduplicate(result.result() if isinstance(result, Future) else result, seen)
+            for result in results
+        ]
+
+    def _run_index(self) -> Optional[NearDuplicateIndex]:
+        # in-memory index of the questions kept by one call
+        if self.dedup_index is None:
+            return None
+        return NearDuplicateIndex(
+            ngram=self.dedup_index.ngram, max_distance=self.dedup_index.max_distance
+        )
+
+    def deduplicate(
+        self, generalized_question_list: List[str], seen: Optional[NearDuplicateIndex] = None
+    ) -> List[str]:
+        """Drop near duplicates of admitted questions and of the questions in seen.
+
+        Kept questions are added to seen, the dedup index itself is left unchanged.
+        """
+        if self.dedup_index is None:
+            return generalized_question_list
+        seen = seen if seen is not None else self._run_index()
+        return [
+            question
+            for question in generalized_question_list
+            if self.dedup_index.find(question) is None and seen.admit(question)
+        ]
+
+    def admit(self, generalized_questions: List[str]) -> List[str]:
+        """Admit saved generalized questions to the dedup index, returning the admitted ones.
+
+        Call this once the output is persisted, so a crashed run does not leave
+        questions in the index that later runs would drop.
+        """
+        if self.dedup_index is None:
+            return generalized_questions
+        return self.dedup_index.filter(generalized_questions)
+
+    def build_batch_messages(self, group: List[Tuple[str, str]], per_item: int):
+        content = "".join(
+            BATCH_CONTENT_TEMPLATE.format(id=index, query=query, question=question)
+            for index, (query, question) in enumerate(group, 1)
+        )
+        return [
+            {
+                "role": "system",
+                "content": BATCH_PROMPT.format(per_item=per_item),
+            },
+            {"role": "user", "content": content},
+        ]
+
+    def post_process_batch(self, response, group_size, per_item):
+        """Group the lines of an id-tagged response by id, at most per_item per id."""
+        grouped = defaultdict(list)
+        for line in response.split("\n"):
+            match = TAGGED_LINE_PATTERN.match(line)
+            if match is None:
+                continue
+            index = int(match.group(1))
+            line = clean_line(match.group(2), self.keywords_to_remove)
+            # skip echoed inputs and extra results
+            if line.startswith("Original Query:") or line.startswith("Original Question:"):
+                continue
+            if 1 <= index <= group_size and line and len(grouped[index]) < per_item:
+                grouped[index].append(line)
+        return dict(grouped)
+
     def post_process(self, response):
         lines = response.split("\n")
         generalized_question_list = []
         for line in lines:
-            # remove keywords
-            for keyword in self.keywords_to_remove:
-                if keyword == ". ":  # remove "1."
-                    dot_index = line.find(". ")
-                    if dot_index != -1:
-                        line = line[dot_index + 2 :]
-                        continue
-                line = line.replace(keyword, "")
-            # remove white space
-            line = line.strip()
+            line = clean_line(line, self.keywords_to_remove)
             if line:
                 generalized_question_list.append(line)
         return generalized_question_list
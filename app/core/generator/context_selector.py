@@ -0,0 +1,142 @@
+"""Bounded selection of in-context examples from a growing corpus.
+
+Generation prompts show validated pairs as examples. Serializing the whole corpus makes
+every prompt grow with it, so ContextSelector keeps a fixed size sample per query shape
+and fills a token budget from it, one example per shape in turn.
+"""
+
+import json
+import random
+import re
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+_AGGREGATION = re.compile(r"\b(count|sum|avg|min|max|collect)\s*\(", re.IGNORECASE)
+# every relationship of a pattern follows a node: (a)-[r]->(b), (a)<--(b)
+_HOP = re.compile(r"\)\s*<?-")
+_CLAUSES = {
+    "optional": re.compile(r"\boptional\s+match\b", re.IGNORECASE),
+    "where": re.compile(r"\bwhere\b", re.IGNORECASE),
+    "with": re.compile(r"\bwith\b", re.IGNORECASE),
+    "order": re.compile(r"\border\s+by\b", re.IGNORECASE),
+    "limit": re.compile(r"\blimit\b", re.IGNORECASE),
+    "distinct": re.compile(r"\bdistinct\b", re.IGNORECASE),
+    "union": re.compile(r"\bunion\b", re.IGNORECASE),
+    "varlength": re.compile(r"\[[^\]]*\*[^\]]*\]"),
+}
+
+
+def query_shape(query: str) -> str:
+    """Coarse structure of a Cypher query, e.g. "hops=2|agg|where|order"."""
+    if not isinstance(query, str):
+        return ""
+    hops = len(_HOP.findall(query))
+    features = [f"hops={min(hops, 3)}"]
+    if _AGGREGATION.search(query):
+        features.append("agg")
+    features.extend(name for name, pattern in _CLAUSES.items() if pattern.search(query))
+    return "|".join(features)
+
+
+class ContextSelector:
+    """Diverse, token bounded sample of corpus pairs used as prompt context.
+
+    Pairs are grouped by the shape of their query and each group keeps a uniform
+    reservoir sample of at most per_shape pairs, so memory and selection cost stay
+    constant however many pairs are added. select draws one pair per shape in turn
+    until the token budget or max_examples is reached.
+
+    Args:
+        token_budget: Maximum tokens of the selected examples, as serialized into the
+            prompt.
+        max_examples: Default maximum number of selected examples, None for no limit.
+        per_shape: Number of pairs kept per query shape.
+        count_tokens: Token counter, e.g. LlmClient.count_tokens. Defaults to an
+            estimate of four characters per token.
+        seed: Seed of the sampling, for reproducible selections.
+    """
+
+    def __init__(
+        self,
+        token_budget: int = 3000,
+        max_examples: Optional[int] = None,
+        per_shape: int = 16,
+        count_tokens: Optional[Callable[[str], int]] = None,
+        seed: Optional[int] = None,
+    ):
+        self.token_budget = token_budget
+        self.max_examples = max_examples
+        self.per_shape = per_shape
+        self.count_tokens = count_tokens or (lambda text: len(text) // 4 + 1)
+        self.added = 0
+        self.last_selected = 0
+        self.last_tokens = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        # shape -> (pairs seen, reservoir of (pair, tokens))
+        self._shapes: Dict[str, Tuple[int, List[Tuple[Dict[str, Any], int]]]] = {}
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(reservoir) for _, reservoir in self._shapes.values())
+
+    def add(self, pair: Dict[str, Any]) -> None:
+        """Offer a pair to the sample of its query shape."""
+        shape = query_shape(pair.get("query"))
+        tokens = self.count_tokens(json.dumps(pair, indent=2, ensure_ascii=False))
+        with self._lock:
+            self.added += 1
+            seen, reservoir = self._shapes.get(shape, (0, []))
+            seen += 1
+            if len(reservoir) < self.per_shape:
+                reservoir.append((pair, tokens))
+            else:
+                slot = self._rng.randrange(seen)
+                if slot < self.per_shape:
+                    reservoir[slot] = (pair, tokens)
+            self._shapes[shape] = (seen, reservoir)
+
+    def add_many(self, pairs: List[Dict[str, Any]]) -> None:
+        for pair in pairs:
+            self.add(pair)
+
+    def select(self, max_examples: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Return a fresh diverse selection that fits the token budget."""
+        max_examples = max_examples if max_examples is not None else self.max_examples
+        with self._lock:
+            shapes = [list(reservoir) for _, reservoir in self._shapes.values()]
+            self._rng.shuffle(shapes)
+            for reservoir in shapes:
+                self._rng.shuffle(reservoir)
+
+        selected = []
+        tokens = 0
+        progress = True
+        while progress:
+            progress = False
+            for reservoir in shapes:
+                if max_examples is not None and len(selected) >= max_examples:
+                    break
+                # pairs that do not fit now will not fit later either, drop them
+                while reservoir:
+                    pair, pair_tokens = reservoir.pop()
+                    if tokens + pair_tokens <= self.token_budget:
+                        selected.append(pair)
+                        tokens += pair_tokens
+                        progress = True
+                        break
+
+        with self._lock:
+            self.last_selected = len(selected)
+            self.last_tokens = tokens
+        return selected
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "added": self.added,
+                "kept": sum(len(reservoir) for _, reservoir in self._shapes.values()),
+                "shapes": len(self._shapes),
+                "last_selected": self.last_selected,
+                "last_tokens": self.last_tokens,
+            }
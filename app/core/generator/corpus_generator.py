@@ -1,15 +1,25 @@
+import contextvars
 import json
+import queue
 import random
+import threading
 import time
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 
+from app.core.generator.context_selector import ContextSelector
 from app.core.llm.llm_client import LlmClient
+from app.core.llm.metrics import llm_stage
 from app.core.prompt import corpus
+from app.core.validator.near_duplicate_index import NearDuplicateIndex
 
 
 class CorpusGenerator:
-    def __init__(self, llm_client: LlmClient):
+    def __init__(self, llm_client: LlmClient, dedup_index: Optional[NearDuplicateIndex] = None):
         self.llm_client = llm_client
+        # generated questions that are near duplicates of admitted ones are dropped
+        # before they are translated or validated, questions are only admitted once
+        # their pair is accepted
+        self.dedup_index = dedup_index
 
     def _extract_json_from_response(self, response: str, expect_list: bool = True):
         """Extract JSON from LLM response."""
@@ -31,6 +41,32 @@ class CorpusGenerator:
             print(f" [RAW RESPONSE]:\n---\n{response}\n---")
             return [] if expect_list else {}
 
+    def _drop_near_duplicate_pairs(
+        self, pairs: List[Dict[str, Any]], admit: bool = False
+    ) -> List[Dict[str, Any]]:
+        kept = []
+        for pair in pairs:
+            question = pair.get("question") if isinstance(pair, dict) else None
+            if not isinstance(question, str):
+                kept.append(pair)
+            elif admit and self.dedup_index.admit(question):
+                kept.append(pair)
+            elif not admit and self.dedup_index.find(question) is None:
+                kept.append(pair)
+        if len(kept) < len(pairs):
+            print(f"  Dropped {len(pairs) - len(kept)} pairs with near-duplicate questions.")
+        return kept
+
+    def admit_pairs(self, pairs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Admit the questions of accepted (e.g. validated) pairs to the dedup index.
+
+        Returns the pairs that were admitted, dropping near duplicates of earlier ones.
+        """
+        if self.dedup_index is None:
+            return pairs
+        return self._drop_near_duplicate_pairs(pairs, admit=True)
+
+    @llm_stage("question_brainstorming")
     def generate_questions_batch(
         self, schema_json: str, context_examples: List[Dict[str, Any]], questions_per_call: int
     ) -> List[str]:
@@ -55,9 +91,20 @@ class CorpusGenerator:
         ]
 
         try:
-            response = self.llm_client.call_with_messages(message)
+            response = self.llm_client.call_with_messages_until_json(message, expect_list=True)
             generated_questions = self._extract_json_from_response(response, expect_list=True)
             if generated_questions:
+                if self.dedup_index is not None:
+                    generated_count = len(generated_questions)
+                    generated_questions = [
+                        question
+                        for question in generated_questions
+                        if self.dedup_index.find(question) is None
+                    ]
+                    print(
+                        f" Dropped {generated_count - len(generated_questions)} "
+                        "near-duplicate questions."
+                    )
                 all_questions.update(generated_questions)
                 print(f" Generated {len(generated_questions)} new questions.")
         except Exception as e:
@@ -65,17 +112,79 @@ class CorpusGenerator:
 
         return list(all_questions)
 
+    @llm_stage("seed_translation")
     def generate_translation_batch(
-        self, schema_json: str, questions: List[str], error_context: Dict[str, str] = None
+        self,
+        schema_json: str,
+        questions: List[str],
+        error_context: Dict[str, str] = None,
+        max_retries: int = 2,
     ) -> List[Dict[str, Any]]:
         """
-        Translate a list of questions into Cypher queries.
-        Supports retries by providing an error_context.
+        Translate a list of questions into Cypher queries with one LLM call.
+
+        Every question is sent with an id and the response is aligned by these ids, so a
+        missing or malformed item does not shift the others. Only the failing ids are
+        sent again, each with the error of its previous attempt, up to max_retries times.
+        error_context maps questions to the error of an earlier attempt, e.g. a failed
+        execution, and is shown to the LLM for these questions.
+        Returns the translated pairs in the order of questions, failures left out.
         """
-        instruction = corpus.TRANSLATION_PROMPT_TEMPLATE.format(
+        errors = dict(error_context) if error_context else {}
+        queries: Dict[int, str] = {}
+        pending = list(range(len(questions)))
+        for attempt in range(max_retries + 1):
+            if not pending:
+                break
+            if attempt:
+                print(f"  Retrying translation of {len(pending)} questions.")
+            response_queries = self._translate_questions(
+                schema_json, [questions[i] for i in pending], errors
+            )
+            failed = []
+            for local_id, i in enumerate(pending, start=1):
+                query = response_queries.get(local_id)
+                if isinstance(query, str) and query.strip():
+                    queries[i] = query
+                    continue
+                failed.append(i)
+                errors[questions[i]] = (
+                    "No query was returned for this question."
+                    if query is None
+                    else "The returned query was empty or not a string."
+                )
+            pending = failed
+
+        if pending:
+            print(f"  Failed to translate {len(pending)} of {len(questions)} questions.")
+        return [
+            {"question": question, "query": queries[i]}
+            for i, question in enumerate(questions)
+            if i in queries
+        ]
+
+    def _translate_questions(
+        self, schema_json: str, questions: List[str], errors: Dict[str, str]
+    ) -> Dict[int, Any]:
+        """Map the 1-based id of each question to the query the LLM returned for it."""
+        questions_json = json.dumps(
+            [{"id": i, "question": q} for i, q in enumerate(questions, start=1)],
+            indent=2,
+            ensure_ascii=False,
+        )
+        error_lines = [
+            f"- id {i} ({question}): {errors[question]}"
+            for i, question in enumerate(questions, start=1)
+            if question in errors
+        ]
+        instruction = corpus.BATCH_TRANSLATION_PROMPT_TEMPLATE.format(
             schema_json=schema_json,
-            question=questions[0],  # Assuming one question per call for clarity
-            error_context=error_context if error_context else "",
+            questions_json=questions_json,
+            error_context=(
+                corpus.BATCH_TRANSLATION_ERROR_TEMPLATE.format(errors="\n".join(error_lines))
+                if error_lines
+                else ""
+            ),
         )
         message = [
             {"role": "system", "content": corpus.SYSTEM_PROMPT},
@@ -83,85 +192,194 @@ class CorpusGenerator:
         ]
 
         try:
-            response = self.llm_client.call_with_messages(message)
-            query_obj = self._extract_json_from_response(response, expect_list=False)
-            query = query_obj.get("query")
-
-            if not query:
-                print("LLM response was empty or malformed.")
-                return []
-
-            return [{"question": questions[0], "query": query}]
-
+            response = self.llm_client.call_with_messages_until_json(message, expect_list=True)
         except Exception as e:
             print(f"LLM call failed during translation: {e}")
-            return []
+            return {}
+        items = self._extract_json_from_response(response, expect_list=True)
+
+        queries = {}
+        for item in items if isinstance(items, list) else []:
+            if not isinstance(item, dict):
+                continue
+            try:
+                item_id = int(item.get("id"))
+            except (TypeError, ValueError):
+                continue
+            if 1 <= item_id <= len(questions):
+                queries.setdefault(item_id, item.get("query"))
+        if len(queries) < len(questions):
+            print(
+                f"LLM response covered {len(queries)} of {len(questions)} questions, "
+                "the rest is retried."
+            )
+        return queries
 
     def generate_seeds_corpus(
-        self, seed_context, target_seeds_size, schema_json, questions_per_call
+        self,
+        seed_context,
+        target_seeds_size,
+        schema_json,
+        questions_per_call,
+        validator=None,
+        translation_workers: int = 4,
+        validation_workers: int = 2,
+        questions_per_translation: int = 10,
+        context_selector: Optional[ContextSelector] = None,
     ) -> List[Dict[str, Any]]:
         """
-        Generate target size seeds corpus base on seed context
+        Generate target size seeds corpus base on seed context.
+
+        Brainstormed questions feed a bounded queue in chunks of questions_per_translation,
+        which translation workers translate with one LLM call each. With a validator (a
+        CorpusValidator) every translated pair is executed against the database as soon
+        as it lands. The target counts validated pairs (translated pairs without a
+        validator), which are returned with their query result summary. An exception in
+        a translation or validation worker stops the pipeline and is raised here.
+
+        The brainstorming prompt shows a diverse selection of the seed context and the
+        accepted pairs that fits the token budget of context_selector, so its size stays
+        constant while the corpus grows.
         """
-        # Initialize an empty list for the corpus and a small set of seed queries for context
+        if context_selector is None:
+            context_selector = ContextSelector(count_tokens=self.llm_client.count_tokens)
+        context_selector.add_many(seed_context)
         seed_corpus = []
+        corpus_lock = threading.Lock()
+        done = threading.Event()
+        question_queue = queue.Queue(maxsize=2 * translation_workers)
+        pair_queue = queue.Queue(maxsize=2 * max(1, validation_workers))
 
-        # ---  Iterative Generation and Validation Loop ---
-        print(f"Targeting a final corpus size of {target_seeds_size} pairs.")
-        iteration = 0
-        while len(seed_corpus) < target_seeds_size:
-            iteration += 1
-            print(f"\n--- Iteration {iteration} ---")
-
-            # Use a mix of seed context and existing corpus context
-            current_context = seed_context + seed_corpus
-
-            # --- Phase A: Generate a batch of questions ---
-            questions_batch = self.generate_questions_batch(
-                schema_json=schema_json,
-                context_examples=current_context,
-                questions_per_call=questions_per_call,
-            )
+        def accept(pair):
+            with corpus_lock:
+                if len(seed_corpus) >= target_seeds_size:
+                    return
+                if self.dedup_index is not None and not self.dedup_index.admit(pair["question"]):
+                    print(f"--> Dropped near-duplicate question '{pair['question']}'.")
+                    return
+                seed_corpus.append(pair)
+                context_selector.add(pair)
+                print(
+                    "--> Successfully added a new pair. "
+                    f"Current there are {len(seed_corpus)} seed corpus pairs"
+                )
+                if len(seed_corpus) >= target_seeds_size:
+                    done.set()
 
-            if not questions_batch:
-                print("No new questions were generated. Stopping iteration.")
-                time.sleep(2)
-                continue
+        def put(target_queue, item):
+            # give up once the target is reached instead of blocking on a full queue
+            while not done.is_set():
+                try:
+                    target_queue.put(item, timeout=0.5)
+                    return
+                except queue.Full:
+                    continue
 
-            # --- Phase B: Translate and Validate questions ---
-            newly_added_count = 0
-            for question in questions_batch:
-                print(f"Translating: '{question}'")
+        def take(source_queue):
+            while not done.is_set():
+                try:
+                    return source_queue.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+            return None
 
-                # Call LLM to translate a single question
-                translation_attempt = self.generate_translation_batch(
-                    schema_json=schema_json, questions=[question]
+        worker_errors = []
+
+        def run_worker(target):
+            # a failing worker stops the pipeline, its error is raised to the caller
+            def run():
+                try:
+                    target()
+                except BaseException as e:
+                    with corpus_lock:
+                        worker_errors.append(e)
+                    done.set()
+
+            return run
+
+        def translate_worker():
+            while (questions := take(question_queue)) is not None:
+                print(f"Translating {len(questions)} questions.")
+                translated_pairs = self.generate_translation_batch(
+                    schema_json=schema_json, questions=questions
                 )
+                for pair in translated_pairs:
+                    if validator is None:
+                        accept(pair)
+                    else:
+                        put(pair_queue, pair)
 
-                if translation_attempt:
-                    seed_corpus.append(translation_attempt[0])
-                    newly_added_count += 1
-                    print(
-                        "--> Successfully translated a new pair. "
-                        f"Current there are {len(seed_corpus)} seed corpus pairs"
-                    )
+        def validate_worker():
+            while (pair := take(pair_queue)) is not None:
+                valid_pair = validator.validate_pair(pair)
+                if valid_pair is not None:
+                    accept(valid_pair)
                 else:
-                    print(f"--> Failed to validate query for '{question}'.")
+                    print(f"--> Failed to validate query for '{pair['question']}'.")
 
-                time.sleep(1)  # Pause to control API rate limits
-                if len(seed_corpus) >= target_seeds_size:
-                    break  # Exit inner loop if target is reached
+        workers = [
+            self._start_worker(run_worker(translate_worker)) for _ in range(translation_workers)
+        ]
+        if validator is not None:
+            workers += [
+                self._start_worker(run_worker(validate_worker)) for _ in range(validation_workers)
+            ]
 
-            print(f"Iteration {iteration} summary: Added {newly_added_count} new translated pairs.")
+        # ---  Iterative Generation, Translation and Validation Pipeline ---
+        print(f"Targeting a final corpus size of {target_seeds_size} pairs.")
+        iteration = 0
+        try:
+            while not done.is_set():
+                iteration += 1
+                print(f"\n--- Iteration {iteration} ---")
+
+                # Use a bounded mix of seed context and existing corpus context
+                current_context = context_selector.select()
+                print(
+                    f"Using {len(current_context)} context examples "
+                    f"(~{context_selector.last_tokens} tokens)."
+                )
+
+                # --- Phase A: Generate a batch of questions ---
+                questions_batch = self.generate_questions_batch(
+                    schema_json=schema_json,
+                    context_examples=current_context,
+                    questions_per_call=questions_per_call,
+                )
 
-        return seed_corpus
+                if not questions_batch:
+                    print("No new questions were generated. Stopping iteration.")
+                    time.sleep(2)
+                    continue
 
+                # --- Phase B: Hand the questions to the translation workers ---
+                for start in range(0, len(questions_batch), questions_per_translation):
+                    put(question_queue, questions_batch[start : start + questions_per_translation])
+        finally:
+            done.set()
+            for worker in workers:
+                worker.join()
+
+        if worker_errors:
+            raise worker_errors[0]
+        return seed_corpus[:target_seeds_size]
+
+    @staticmethod
+    def _start_worker(target) -> threading.Thread:
+        # workers keep the llm_stage of the caller
+        context = contextvars.copy_context()
+        worker = threading.Thread(target=context.run, args=(target,), daemon=True)
+        worker.start()
+        return worker
+
+    @llm_stage("corpus_generation")
     def run_generation_loop(
         self,
         schema_json: str,
         seeds_corpus_with_context: List[Dict[str, Any]],
         num_per_iteration: int = 5,
         complexity_corpus_size: int = 30,
+        context_selector: Optional[ContextSelector] = None,
     ) -> List[Dict[str, Any]]:
         """
         Run the main generation loop,
@@ -169,9 +387,14 @@ class CorpusGenerator:
         Args:
             num_per_iteration: Number of Q&A pairs to generate per iteration
             complexity_corpus_size: Target strong corpus size
+            context_selector: Selector the examples of each prompt are drawn from, by
+                default one built from seeds_corpus_with_context
         """
         print(f"Starting iterative generation loop. Target corpus size: {complexity_corpus_size}")
         print(f"Starting with {len(seeds_corpus_with_context)} initial pairs")
+        if context_selector is None:
+            context_selector = ContextSelector(count_tokens=self.llm_client.count_tokens)
+            context_selector.add_many(seeds_corpus_with_context)
         complexity_corpus = []
         iteration_count = 0
 
@@ -185,12 +408,9 @@ class CorpusGenerator:
                     f"Remaining to target: {complexity_corpus_size - len(complexity_corpus)} pairs"
                 )
 
-                # Randomly select 3/10 of existing corpus as examples (at least 3, maximum 10)
+                # Select 3 to 7 examples of different query shapes within the token budget
                 example_count = int(3 + (7 - 3) * random.random())
-                random_examples = random.sample(
-                    seeds_corpus_with_context, min(example_count, len(seeds_corpus_with_context))
-                )
-                selected_contexts = random_examples
+                selected_contexts = context_selector.select(max_examples=example_count)
 
                 # 1. Build Prompt
                 instruction = corpus.INSTRUCTION_TEMPLATE.format(
@@ -205,15 +425,17 @@ class CorpusGenerator:
 
                 # 2. Call LLM
                 print(f"  Calling LLM to generate {num_per_iteration} new pairs...")
-                print(f"  Using {len(selected_contexts)} randomly selected examples as context")
+                print(f"  Using {len(selected_contexts)} selected examples as context")
                 try:
-                    response = self.llm_client.call_with_messages(message)
+                    response = self.llm_client.call_with_messages_until_json(message)
                     new_pairs = self._extract_json_from_response(response)
                     if not new_pairs:
                         print("  LLM did not return valid pairs. Skipping iteration.")
                         time.sleep(2)
                         continue
                     else:
+                        if self.dedup_index is not None:
+                            new_pairs = self._drop_near_duplicate_pairs(new_pairs)
                         # add new pairs to strong corpus
                         complexity_corpus.extend(new_pairs)
                     print(f"  LLM returned {len(new_pairs)} new pairs.")
@@ -227,9 +449,6 @@ class CorpusGenerator:
                     print(f"\nTarget corpus size of {complexity_corpus_size} reached!")
                     break
 
-                # Control API call frequency
-                time.sleep(2)
-
         except KeyboardInterrupt:
             print("\nKeyboardInterrupt detected! Saving corpus before exit...")
             return complexity_corpus
@@ -239,6 +458,7 @@ class CorpusGenerator:
         # Final corpus save
         return complexity_corpus
 
+    @llm_stage("template_generation")
     def generate_template_based_corpus(
         self, exploration_results: List[Any], query_templates: List[str], target_size: int = 10
     ) -> List[Dict[str, Any]]:
@@ -290,7 +510,9 @@ class CorpusGenerator:
 
             # 4. Call LLM
             try:
-                response = self.llm_client.call_with_messages(message)
+                response = self.llm_client.call_with_messages_until_json(
+                    message, expect_list=True
+                )
                 new_pairs = self._extract_json_from_response(response, expect_list=True)
 
                 if new_pairs and isinstance(new_pairs, list):
@@ -314,6 +536,4 @@ class CorpusGenerator:
                 print(f" -> LLM Call failed: {e}")
                 time.sleep(1)
 
-            time.sleep(0.5)
-
         return generated_corpus[:target_size]
@@ -8,6 +8,7 @@ import time
 from typing import List, Tuple
 
 from app.core.llm.llm_client import LlmClient
+from app.core.llm.metrics import llm_stage
 from app.core.prompt import data
 
 
@@ -26,6 +27,7 @@ class DataGenerator:
         # If no code block found, return entire response as fallback (assuming it's all code)
         return response.strip()
 
+    @llm_stage("data_generation")
     def generate_data_script(self, schema_json) -> str:
         """Call LLM to generate data generation Python script."""
 
@@ -80,6 +82,7 @@ class DataGenerator:
 
         return code
 
+    @llm_stage("data_generation")
     def generate_data(
         self, schema_file, output_base: str = "examples/generated_data", max_retries: int = 2
     ) -> Tuple[str, List[Path]]:
@@ -208,6 +211,7 @@ class DataGenerator:
 
         return json.dumps(data, indent=2)
 
+    @llm_stage("import_config_generation")
     def generate_import_config(self, schema_file, csv_file_info: str, output_path):
         with open(schema_file, encoding="utf-8") as f:
             schema_json = json.dumps(json.load(f), ensure_ascii=False)
@@ -3,6 +3,7 @@ from typing import Dict, List
 from venv import logger
 
 from app.core.llm.llm_client import LlmClient
+from app.core.llm.metrics import llm_stage
 from app.core.prompt import schema
 from app.core.schema.edge import Edge
 from app.core.schema.node import Node
@@ -23,6 +24,7 @@ class SchemaGenerator:
         """Calculate relationship count range based on complexity level"""
         return {1: (2, 4), 2: (4, 7), 3: (7, 12), 4: (12, 20), 5: (20, 35)}.get(complexity, (4, 8))
 
+    @llm_stage("schema_description")
     def generate_des(self, domain: str, subdomain: str) -> str:
         llm_client = self._llm_client
 
@@ -41,6 +43,7 @@ class SchemaGenerator:
         response = llm_client.call_with_messages(messages)
         return response
 
+    @llm_stage("schema_generation")
     def generate_schema(self, domain: str, subdomain: str, complexity_level: int) -> SchemaGraph:
         node_range = self._calc_node_range(complexity_level)
         rel_range = self._calc_relationship_range(complexity_level)
@@ -0,0 +1,170 @@
+"""Offline batch jobs: submit many requests as one provider batch file and collect results.
+
+Requests are written in the OpenAI batch JSONL format ({"custom_id", "method", "url",
+"body"}), which DashScope accepts through its OpenAI compatible endpoint. Results are
+mapped back by custom_id. LocalBatchBackend processes the same files with an LlmClient,
+so the whole path can be exercised without a provider.
+"""
+
+from abc import ABC, abstractmethod
+import json
+import os
+import threading
+from typing import Dict, Iterable, Optional
+import uuid
+
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+# The OpenAI batch API accepts at most 50,000 requests per input file
+MAX_REQUESTS_PER_FILE = 50000
+
+
+class BatchJobNotFound(KeyError):
+    """The backend does not know the job, e.g. a local job of an earlier process."""
+
+
+class BatchBackend(ABC):
+    """Provider side of a batch job."""
+
+    @abstractmethod
+    def submit(self, input_path: str) -> str:
+        """Upload a request JSONL file and start a job, returning its id."""
+
+    @abstractmethod
+    def status(self, job_id: str) -> str:
+        """Return the job status, one of TERMINAL_STATUSES once it finished.
+
+        Raises BatchJobNotFound for job ids the backend does not know.
+        """
+
+    @abstractmethod
+    def download(self, job_id: str, output_path: str) -> bool:
+        """Write the result JSONL of a finished job, False if it produced none."""
+
+
+class OpenAIBatchBackend(BatchBackend):
+    """Batch API of OpenAI and OpenAI compatible providers.
+
+    Args:
+        client: An openai.OpenAI client, its base_url selects the provider.
+        completion_window: Time the provider has to finish the job.
+    """
+
+    def __init__(self, client, completion_window: str = "24h"):
+        self.client = client
+        self.completion_window = completion_window
+
+    def submit(self, input_path: str) -> str:
+        with open(input_path, "rb") as f:
+            input_file = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window=self.completion_window,
+        )
+        return batch.id
+
+    def status(self, job_id: str) -> str:
+        try:
+            return self.client.batches.retrieve(job_id).status
+        except Exception as e:
+            if getattr(e, "status_code", None) == 404:
+                raise BatchJobNotFound(job_id) from e
+            raise
+
+    def download(self, job_id: str, output_path: str) -> bool:
+        batch = self.client.batches.retrieve(job_id)
+        # expired jobs still return the requests that were completed in time
+        if not batch.output_file_id:
+            return False
+        content = self.client.files.content(batch.output_file_id)
+        with open(output_path, "wb") as f:
+            f.write(content.read())
+        return True
+
+
+class LocalBatchBackend(BatchBackend):
+    """Stand-in provider that answers a batch file with an LlmClient in a thread.
+
+    Args:
+        llm_client: Client answering the requests, e.g. a replay or local model client.
+    """
+
+    def __init__(self, llm_client):
+        self.llm_client = llm_client
+        self._jobs: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, input_path: str) -> str:
+        job_id = f"batch_local_{uuid.uuid4().hex}"
+        job = {"status": "in_progress", "lines": []}
+        with self._lock:
+            self._jobs[job_id] = job
+        threading.Thread(target=self._run, args=(job, input_path), daemon=True).start()
+        return job_id
+
+    def _run(self, job: dict, input_path: str) -> None:
+        with open(input_path, encoding="utf-8") as f:
+            requests = [json.loads(line) for line in f if line.strip()]
+        outputs = self.llm_client.call_with_messages_batch(
+            [request["body"]["messages"] for request in requests]
+        )
+        lines = []
+        for request, output in zip(requests, outputs):
+            result = {"id": f"batch_req_{uuid.uuid4().hex}", "custom_id": request["custom_id"]}
+            if output:
+                choice = {"index": 0, "message": {"role": "assistant", "content": output}}
+                result["response"] = {"status_code": 200, "body": {"choices": [choice]}}
+                result["error"] = None
+            else:
+                result["response"] = None
+                result["error"] = {"code": "empty_response", "message": "No output"}
+            lines.append(json.dumps(result, ensure_ascii=False))
+        with self._lock:
+            job["lines"] = lines
+            job["status"] = "completed"
+
+    def status(self, job_id: str) -> str:
+        with self._lock:
+            # jobs live in memory and are gone once the process that submitted them exits
+            if job_id not in self._jobs:
+                raise BatchJobNotFound(job_id)
+            return self._jobs[job_id]["status"]
+
+    def download(self, job_id: str, output_path: str) -> bool:
+        with self._lock:
+            lines = self._jobs[job_id]["lines"]
+        with open(output_path, "w", encoding="utf-8") as f:
+            f.writelines(line + "\n" for line in lines)
+        return True
+
+
+def write_batch_input(path: str, requests: Iterable[tuple]) -> None:
+    """Write (custom_id, body) pairs as a chat completions batch input file."""
+    with open(path, "w", encoding="utf-8") as f:
+        for custom_id, body in requests:
+            line = {
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": body,
+            }
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+
+
+def read_batch_output(path: str) -> Dict[str, Optional[str]]:
+    """Map custom_id to the response content, None for requests that failed."""
+    results = {}
+    if not os.path.exists(path):
+        return results
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            response = result.get("response") or {}
+            content = None
+            if response.get("status_code") == 200:
+                content = response["body"]["choices"][0]["message"]["content"]
+            results[result["custom_id"]] = content
+    return results
@@ -0,0 +1,259 @@
+"""Model cascade: answer with a cheap model first and escalate only rejected outputs.
+
+CascadingLlmClient exposes the calling methods of LlmClient, so it can be passed to the
+generators, translators and grader in place of a single client.
+"""
+
+import threading
+from typing import Callable, Dict, List, Optional, Set
+
+from app.core.llm.json_stream import JsonStreamExtractor
+from app.core.llm.llm_client import LlmClient
+from app.core.llm.tagged_lines import TAGGED_LINE_PATTERN
+
+# Decides whether an output is good enough: validator(messages, output) -> bool
+Validator = Callable[[List[Dict[str, str]], str], bool]
+
+
+def non_empty_validator(messages: List[Dict[str, str]], output: str) -> bool:
+    return bool(output and output.strip())
+
+
+def json_validator(expect_list: bool = True) -> Validator:
+    """Accept outputs that contain a complete JSON list (or object)."""
+
+    def validate(messages, output):
+        extractor = JsonStreamExtractor(expect_list)
+        return bool(output) and extractor.feed(output)
+
+    return validate
+
+
+def tagged_line_validator() -> Validator:
+    """Accept outputs with a non-empty "[n] ..." line for every "[n]" item of the request.
+
+    The expected indices are read from the last user turn, so one validator serves
+    chunks of any size, e.g. the tagged chunks of QuestionTranslator.
+    """
+
+    def validate(messages, output):
+        user_turns = [message["content"] for message in messages if message["role"] == "user"]
+        expected = _tagged_indices(user_turns[-1] if user_turns else "")
+        answered = _tagged_indices(output or "")
+        if not expected:
+            return non_empty_validator(messages, output)
+        return expected <= answered
+
+    return validate
+
+
+def _tagged_indices(text: str) -> Set[int]:
+    indices = set()
+    for line in text.split("\n"):
+        match = TAGGED_LINE_PATTERN.match(line)
+        if match is not None and match.group(2).strip():
+            indices.add(int(match.group(1)))
+    return indices
+
+
+def json_field_validator(field: str, allowed) -> Validator:
+    """Accept JSON lists whose items all set field to one of allowed values.
+
+    The field may also sit in a nested object of the item, e.g. {"grade_info":
+    {"difficulty": "Easy"}}, and string values are compared case-insensitively.
+    """
+    allowed = {value.lower() if isinstance(value, str) else value for value in allowed}
+
+    def field_value(item):
+        if field in item:
+            return item[field]
+        for value in item.values():
+            if isinstance(value, dict) and field in value:
+                return value[field]
+        return None
+
+    def validate(messages, output):
+        extractor = JsonStreamExtractor(expect_list=True)
+        if not output or not extractor.feed(output):
+            return False
+        items = extractor.value
+        if not items:
+            return False
+        for item in items:
+            value = field_value(item) if isinstance(item, dict) else None
+            if (value.lower() if isinstance(value, str) else value) not in allowed:
+                return False
+        return True
+
+    return validate
+
+
+class CascadingLlmClient:
+    """Routes each request through tiers of LlmClients, cheapest first.
+
+    A request goes to the next tier only when the validator rejects the output of the
+    current one. The output of the last tier is returned as is.
+
+    Args:
+        clients: LlmClients ordered from the cheapest to the strongest model.
+        validator: Default validator of every call. Calls that stop at the first JSON
+            value additionally require that value to be complete.
+    """
+
+    def __init__(self, clients: List[LlmClient], validator: Optional[Validator] = None):
+        if not clients:
+            raise ValueError("CascadingLlmClient needs at least one client")
+        self.clients = clients
+        self.validator = validator or non_empty_validator
+        self._lock = threading.Lock()
+        # number of requests answered by each tier
+        self.served = [0] * len(clients)
+
+    def _validator(self, validator, until_json=False, expect_list=True):
+        validator = validator or self.validator
+        if not until_json:
+            return validator
+        is_json = json_validator(expect_list)
+        return lambda messages, output: is_json(messages, output) and validator(messages, output)
+
+    def _count(self, tier):
+        with self._lock:
+            self.served[tier] += 1
+
+    def _cascade(self, call, messages, validator):
+        for tier, client in enumerate(self.clients):
+            output = call(client)
+            if tier == len(self.clients) - 1 or validator(messages, output):
+                self._count(tier)
+                return output
+
+    async def _acascade(self, call, messages, validator):
+        for tier, client in enumerate(self.clients):
+            output = await call(client)
+            if tier == len(self.clients) - 1 or validator(messages, output):
+                self._count(tier)
+                return output
+
+    def call_with_messages(self, messages, validator: Optional[Validator] = None):
+        return self._cascade(
+            lambda client: client.call_with_messages(messages),
+            messages,
+            self._validator(validator),
+        )
+
+    async def acall_with_messages(self, messages, validator: Optional[Validator] = None):
+        return await self._acascade(
+            lambda client: client.acall_with_messages(messages),
+            messages,
+            self._validator(validator),
+        )
+
+    def call_with_messages_until_json(
+        self, messages, expect_list=True, validator: Optional[Validator] = None
+    ):
+        return self._cascade(
+            lambda client: client.call_with_messages_until_json(messages, expect_list),
+            messages,
+            self._validator(validator, True, expect_list),
+        )
+
+    async def acall_with_messages_until_json(
+        self, messages, expect_list=True, validator: Optional[Validator] = None
+    ):
+        return await self._acascade(
+            lambda client: client.acall_with_messages_until_json(messages, expect_list),
+            messages,
+            self._validator(validator, True, expect_list),
+        )
+
+    def call_with_messages_batch(
+        self,
+        messages_list,
+        batch_size=8,
+        until_json=False,
+        expect_list=True,
+        validator: Optional[Validator] = None,
+    ):
+        """Batch call where only the rejected conversations move on to the next tier."""
+        validator = self._validator(validator, until_json, expect_list)
+        outputs = [None] * len(messages_list)
+        pending = list(range(len(messages_list)))
+        for tier, client in enumerate(self.clients):
+            tier_outputs = client.call_with_messages_batch(
+                [messages_list[i] for i in pending], batch_size, until_json, expect_list
+            )
+            last_tier = tier == len(self.clients) - 1
+            rejected = []
+            for i, output in zip(pending, tier_outputs):
+                outputs[i] = output
+                if last_tier or validator(messages_list[i], output):
+                    self._count(tier)
+                else:
+                    rejected.append(i)
+            pending = rejected
+            if not pending:
+                break
+        return outputs
+
+    def call_with_messages_batch_job(
+        self,
+        messages_list,
+        job_name="batch",
+        work_dir=".llm_batches",
+        backend=None,
+        poll_interval=30.0,
+        timeout=None,
+        validator: Optional[Validator] = None,
+    ):
+        """Batch job per tier, the rejected conversations go into the job of the next tier.
+
+        A backend given here is used for every tier, by default each client submits to
+        its own provider.
+        """
+        validator = self._validator(validator)
+        outputs = [None] * len(messages_list)
+        pending = list(range(len(messages_list)))
+        for tier, client in enumerate(self.clients):
+            tier_outputs = client.call_with_messages_batch_job(
+                [messages_list[i] for i in pending],
+                job_name=f"{job_name}.tier{tier}",
+                work_dir=work_dir,
+                backend=backend,
+                poll_interval=poll_interval,
+                timeout=timeout,
+            )
+            last_tier = tier == len(self.clients) - 1
+            rejected = []
+            for i, output in zip(pending, tier_outputs):
+                outputs[i] = output
+                if last_tier or validator(messages_list[i], output):
+                    self._count(tier)
+                else:
+                    rejected.append(i)
+            pending = rejected
+            if not pending:
+                break
+        return outputs
+
+    def stats(self) -> Dict[str, int]:
+        """Requests served per model, keyed by "tier/model"."""
+        with self._lock:
+            return {
+                f"{tier}/{client._model_name()}": served
+                for tier, (client, served) in enumerate(zip(self.clients, self.served))
+            }
+
+    def invalidate(self, messages):
+        for client in self.clients:
+            client.invalidate(messages)
+
+    def count_tokens(self, text):
+        return self.clients[0].count_tokens(text)
+
+    def stream_with_messages(self, messages):
+        # a stream cannot be validated before it is consumed, use the strongest model
+        yield from self.clients[-1].stream_with_messages(messages)
+
+    async def astream_with_messages(self, messages):
+        async for chunk in self.clients[-1].astream_with_messages(messages):
+            yield chunk
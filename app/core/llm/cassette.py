@@ -0,0 +1,134 @@
+"""Record/replay of LLM responses for offline, deterministic pipeline runs.
+
+An LlmClient with platform="record" forwards calls to a real backend and appends every
+response to a JSONL cassette; platform="replay" serves responses from that cassette
+with configurable synthetic latency and injected errors, so the generators, translators
+and grader can be benchmarked without network access or API keys.
+"""
+
+import asyncio
+from collections import defaultdict
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from typing import Dict, List, Optional
+
+from app.core.llm.rate_limiter import RateLimitExceeded
+
+
+class Cassette:
+    """JSONL cassette of recorded LLM responses.
+
+    Each line holds {"key", "model", "messages", "response"}. A request recorded several
+    times is replayed round-robin over its recorded responses. Responses of streams the
+    caller stopped early are recorded as partial and only replayed to callers that
+    accept partial responses, and only when no complete response was recorded.
+
+    Args:
+        path: Location of the cassette file, created on the first recording.
+        latency: Synthetic latency in seconds added to every replayed call.
+        latency_jitter: Uniform random extra latency in seconds on top of latency.
+        rate_limit_rate: Fraction of replayed calls that raise a rate limit error.
+        failure_rate: Fraction of replayed calls that fail with an empty response.
+        seed: Seed of the random generator driving jitter and error injection.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        latency: float = 0.0,
+        latency_jitter: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        failure_rate: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        self.path = path
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.rate_limit_rate = rate_limit_rate
+        self.failure_rate = failure_rate
+        self.misses = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._responses: Dict[str, List[str]] = defaultdict(list)
+        self._replay_counts: Dict[str, int] = defaultdict(int)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._responses[entry["key"]].append(entry["response"])
+
+    @staticmethod
+    def make_key(model: str, messages: List[Dict[str, str]], partial: bool = False) -> str:
+        """Platform independent key, so a recording can be replayed by any client."""
+        request = {"model": model, "messages": messages}
+        if partial:
+            request["partial"] = True
+        payload = json.dumps(request, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def __len__(self) -> int:
+        return sum(len(responses) for responses in self._responses.values())
+
+    def record(
+        self, model: str, messages: List[Dict[str, str]], response: str, partial: bool = False
+    ) -> None:
+        key = self.make_key(model, messages, partial)
+        entry = {"key": key, "model": model, "messages": messages, "response": response}
+        if partial:
+            entry["partial"] = True
+        with self._lock:
+            self._responses[key].append(response)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def _next_response(
+        self, model: str, messages: List[Dict[str, str]], accept_partial: bool
+    ) -> str:
+        key = self.make_key(model, messages)
+        with self._lock:
+            responses = self._responses.get(key)
+            if not responses and accept_partial:
+                key = self.make_key(model, messages, partial=True)
+                responses = self._responses.get(key)
+            if not responses:
+                self.misses += 1
+                print("Failed! No recorded response for", messages[-1]["content"][:200])
+                return ""
+            response = responses[self._replay_counts[key] % len(responses)]
+            self._replay_counts[key] += 1
+            return response
+
+    def _draw(self):
+        with self._lock:
+            delay = self.latency + self._random.uniform(0, self.latency_jitter)
+            roll = self._random.random()
+        return delay, roll
+
+    def _inject(self, roll: float) -> bool:
+        """Raise an injected rate limit error, or return True for an injected failure."""
+        if roll < self.rate_limit_rate:
+            raise RateLimitExceeded("Injected rate limit error from cassette replay")
+        return roll < self.rate_limit_rate + self.failure_rate
+
+    def replay(
+        self, model: str, messages: List[Dict[str, str]], accept_partial: bool = False
+    ) -> str:
+        delay, roll = self._draw()
+        time.sleep(delay)
+        if self._inject(roll):
+            return ""
+        return self._next_response(model, messages, accept_partial)
+
+    async def areplay(
+        self, model: str, messages: List[Dict[str, str]], accept_partial: bool = False
+    ) -> str:
+        delay, roll = self._draw()
+        await asyncio.sleep(delay)
+        if self._inject(roll):
+            return ""
+        return self._next_response(model, messages, accept_partial)
@@ -0,0 +1,109 @@
+"""Load balancing of LLM calls over several endpoints (API keys, gateways, models)."""
+
+from dataclasses import dataclass, field
+import threading
+import time
+from typing import List, Optional, Set
+
+
+@dataclass
+class LlmEndpoint:
+    """One place an LLM call can be sent to.
+
+    base_url only applies to OpenAI compatible endpoints, api_key falls back to the
+    platform's environment variable when empty.
+    """
+
+    platform: str
+    model: str
+    base_url: Optional[str] = None
+    api_key: Optional[str] = None
+    weight: int = 1
+    name: str = ""
+    # runtime state maintained by EndpointPool
+    outstanding: int = field(default=0, compare=False, repr=False)
+    consecutive_failures: int = field(default=0, compare=False, repr=False)
+    cooldown_until: float = field(default=0.0, compare=False, repr=False)
+    current_weight: int = field(default=0, compare=False, repr=False)
+
+
+class EndpointPool:
+    """Picks an endpoint per call and takes failing endpoints out of rotation for a while.
+
+    Args:
+        endpoints: Endpoints to balance over.
+        strategy: "round_robin" for smooth weighted round-robin, or "least_outstanding"
+            for the endpoint with the fewest in-flight calls relative to its weight.
+        cooldown: Seconds an endpoint is skipped after a failure, doubled for every
+            consecutive failure up to max_cooldown.
+        max_cooldown: Upper bound of the cooldown in seconds.
+    """
+
+    STRATEGIES = ("round_robin", "least_outstanding")
+
+    def __init__(
+        self,
+        endpoints: List[LlmEndpoint],
+        strategy: str = "round_robin",
+        cooldown: float = 5.0,
+        max_cooldown: float = 120.0,
+    ):
+        if not endpoints:
+            raise ValueError("EndpointPool needs at least one endpoint")
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f"Unknown strategy '{strategy}', expected one of {self.STRATEGIES}")
+        for i, endpoint in enumerate(endpoints):
+            if not endpoint.name:
+                endpoint.name = f"{endpoint.platform}:{endpoint.model}#{i}"
+        self.endpoints = endpoints
+        self.strategy = strategy
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.endpoints)
+
+    def acquire(self, exclude: Optional[Set[str]] = None) -> LlmEndpoint:
+        """Pick an endpoint for one call and count it as outstanding.
+
+        Endpoints in exclude or cooling down are skipped while others are available.
+        """
+        exclude = exclude or set()
+        now = time.monotonic()
+        with self._lock:
+            candidates = [e for e in self.endpoints if e.name not in exclude] or self.endpoints
+            healthy = [e for e in candidates if e.cooldown_until <= now]
+            if healthy:
+                endpoint = self._pick(healthy)
+            else:
+                # everything is cooling down, use the one that recovers first
+                endpoint = min(candidates, key=lambda e: e.cooldown_until)
+            endpoint.outstanding += 1
+            return endpoint
+
+    def _pick(self, candidates: List[LlmEndpoint]) -> LlmEndpoint:
+        # caller holds self._lock
+        if self.strategy == "least_outstanding":
+            return min(candidates, key=lambda e: e.outstanding / max(e.weight, 1))
+        # smooth weighted round-robin (as in nginx), spreads heavy endpoints evenly
+        total_weight = sum(e.weight for e in candidates)
+        for e in candidates:
+            e.current_weight += e.weight
+        best = max(candidates, key=lambda e: e.current_weight)
+        best.current_weight -= total_weight
+        return best
+
+    def release(self, endpoint: LlmEndpoint, success: bool) -> None:
+        """Finish a call, putting the endpoint into cooldown if it failed."""
+        with self._lock:
+            endpoint.outstanding -= 1
+            if success:
+                endpoint.consecutive_failures = 0
+                endpoint.cooldown_until = 0.0
+            else:
+                endpoint.consecutive_failures += 1
+                cooldown = min(
+                    self.max_cooldown, self.cooldown * 2 ** (endpoint.consecutive_failures - 1)
+                )
+                endpoint.cooldown_until = time.monotonic() + cooldown
@@ -0,0 +1,70 @@
+"""Incremental detection of the first complete JSON value in a streamed LLM response."""
+
+import json
+
+
+class JsonStreamExtractor:
+    """Scans streamed text for the first balanced JSON array or object that parses.
+
+    Feed chunks as they arrive; once feed returns True the payload is complete and the
+    rest of the stream can be dropped.
+
+    Attributes:
+        text: All text received so far.
+        end: Index in text right after the closing bracket, or -1 while incomplete.
+        value: The parsed JSON value once complete.
+    """
+
+    def __init__(self, expect_list: bool = True):
+        self.open_char, self.close_char = ("[", "]") if expect_list else ("{", "}")
+        self.text = ""
+        self.end = -1
+        self.value = None
+        self._pos = 0
+        self._start = -1
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, chunk: str) -> bool:
+        """Add a chunk of text. Returns True once a complete JSON value was found."""
+        self.text += chunk
+        while self.end == -1 and self._pos < len(self.text):
+            ch = self.text[self._pos]
+            if self._start == -1:
+                if ch == self.open_char:
+                    self._start = self._pos
+                    self._depth = 1
+            elif self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "[{":
+                self._depth += 1
+            elif ch in "]}":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._close_value()
+            self._pos += 1
+        return self.end != -1
+
+    def _close_value(self) -> None:
+        try:
+            self.value = json.loads(self.text[self._start : self._pos + 1])
+            self.end = self._pos + 1
+        except json.JSONDecodeError:
+            # not JSON after all (e.g. "[Note]"), resume scanning after the opening bracket
+            self._pos = self._start
+            self._start = -1
+            self._depth = 0
+            self._in_string = False
+            self._escaped = False
+
+    def output(self) -> str:
+        """Text up to the end of the JSON value, or everything received if incomplete."""
+        return self.text[: self.end] if self.end != -1 else self.text
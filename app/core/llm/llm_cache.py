@@ -0,0 +1,208 @@
+"""Persistent LLM response cache.
+
+Responses are stored in a local SQLite file keyed by a content hash of the request
+(platform, model, messages and sampling params), so re-running a pipeline after a
+crash or a prompt tweak only pays for the requests that actually changed.
+"""
+
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class LlmCache:
+    """Content-addressed response cache backed by SQLite.
+
+    Entries older than ``max_age_seconds`` are treated as misses and purged, and the
+    least recently used entries are evicted once the cache exceeds ``max_entries`` or
+    ``max_size_bytes``. Eviction goes down to ``evict_to`` of both budgets, so it runs
+    once per many puts instead of on every put.
+
+    Attributes:
+        path: Location of the SQLite file.
+        hits: Number of lookups served from the cache.
+        misses: Number of lookups that had to go to the LLM.
+    """
+
+    def __init__(
+        self,
+        path: str = ".llm_cache.sqlite",
+        max_entries: Optional[int] = 100000,
+        max_size_bytes: Optional[int] = 1024 * 1024 * 1024,
+        max_age_seconds: Optional[float] = None,
+        evict_to: float = 0.9,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_size_bytes = max_size_bytes
+        self.max_age_seconds = max_age_seconds
+        self.evict_to = evict_to
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY,"
+            " response TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_responses_accessed_at ON responses (accessed_at)"
+        )
+        self._conn.commit()
+        # running totals, so a put does not have to scan the table
+        self._entries, self._size = self._count()
+
+    @staticmethod
+    def make_key(
+        platform: str, model: str, messages: List[Dict[str, str]], params: Dict[str, Any]
+    ) -> str:
+        """Hash a request into a stable cache key."""
+        payload = json.dumps(
+            {"platform": platform, "model": model, "messages": messages, "params": params},
+            sort_keys=True,
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached response for key, or None on a miss."""
+        return self.get_first([key])
+
+    def get_first(self, keys: List[str]) -> Optional[str]:
+        """Return the cached response of the first key present, counted as one lookup."""
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                row = self._conn.execute(
+                    "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and self._is_expired(row[1], now):
+                    self._delete([key])
+                    self._conn.commit()
+                    row = None
+                if row is None:
+                    continue
+                self._conn.execute(
+                    "UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key)
+                )
+                self._conn.commit()
+                self.hits += 1
+                return row[0]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, response: str) -> None:
+        """Store a response and evict old entries if the cache is over budget."""
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            self._delete([key])
+            self._conn.execute(
+                "INSERT INTO responses (key, response, size, created_at, accessed_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, response, size, now, now),
+            )
+            self._entries += 1
+            self._size += size
+            if self._over_budget(1.0):
+                self._evict(now)
+            self._conn.commit()
+
+    def delete(self, *keys: str) -> None:
+        """Drop the responses of keys, e.g. one the caller rejected."""
+        with self._lock:
+            self._delete(keys)
+            self._conn.commit()
+
+    def _delete(self, keys) -> None:
+        # caller holds self._lock
+        for key in keys:
+            row = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._entries -= 1
+                self._size -= row[0]
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters together with the current cache size."""
+        with self._lock:
+            entries, size = self._entries, self._size
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "size_bytes": size,
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+            self._entries, self._size = 0, 0
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _is_expired(self, created_at: float, now: float) -> bool:
+        return self.max_age_seconds is not None and now - created_at > self.max_age_seconds
+
+    def _count(self):
+        # caller holds self._lock or is the constructor
+        return self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+
+    def _over_budget(self, fraction: float) -> bool:
+        # caller holds self._lock
+        return (self.max_entries is not None and self._entries > self.max_entries * fraction) or (
+            self.max_size_bytes is not None and self._size > self.max_size_bytes * fraction
+        )
+
+    def _evict(self, now: float) -> None:
+        # caller holds self._lock
+        if self.max_age_seconds is not None:
+            self._conn.execute(
+                "DELETE FROM responses WHERE created_at < ?", (now - self.max_age_seconds,)
+            )
+            self._entries, self._size = self._count()
+        # evict below the budgets, so the next puts do not have to evict again
+        over_entries = (
+            self._entries - int(self.max_entries * self.evict_to)
+            if self.max_entries is not None
+            else 0
+        )
+        over_size = (
+            self._size - int(self.max_size_bytes * self.evict_to)
+            if self.max_size_bytes is not None
+            else 0
+        )
+        if over_entries <= 0 and over_size <= 0:
+            return
+        # walk entries from least recently used and drop until both budgets are met
+        evicted_keys = []
+        for key, entry_size in self._conn.execute(
+            "SELECT key, size FROM responses ORDER BY accessed_at ASC"
+        ):
+            if over_entries <= 0 and over_size <= 0:
+                break
+            evicted_keys.append((key,))
+            over_entries -= 1
+            over_size -= entry_size
+            self._entries -= 1
+            self._size -= entry_size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", evicted_keys)
+        logger.debug(f"Evicted {len(evicted_keys)} entries from LLM cache {self.path}")
@@ -1,55 +1,1170 @@
+import asyncio
+import contextvars
+import hashlib
 from http import HTTPStatus
+import json
 import os
 import random
+import threading
 import time
+from typing import List
+import weakref
 
-from dashscope import Generation
-import openai
-from openai import OpenAI, OpenAIError
-import torch
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from app.core.llm.batch_job import (
+    MAX_REQUESTS_PER_FILE,
+    TERMINAL_STATUSES,
+    BatchBackend,
+    BatchJobNotFound,
+    LocalBatchBackend,
+    OpenAIBatchBackend,
+    read_batch_output,
+    write_batch_input,
+)
+from app.core.llm.cassette import Cassette
+from app.core.llm.endpoint_pool import EndpointPool, LlmEndpoint
+from app.core.llm.json_stream import JsonStreamExtractor
+from app.core.llm.llm_cache import LlmCache
+from app.core.llm.metrics import CallUsage, LlmCallRecord, MetricsSink, current_stage
+from app.core.llm.prefix_cache import PrefixKvCache
+from app.core.llm.rate_limiter import (
+    ModelRateLimiter,
+    RateLimitExceeded,
+    estimate_tokens,
+    get_rate_limiter,
+)
+from app.core.llm.single_flight import SingleFlight
+
+# Backend SDKs (openai, dashscope, torch, transformers) are imported on first use, so
+# importing this module stays cheap for callers that only talk to a remote API.
+
+# Long-lived OpenAI clients shared by every LlmClient in the process, keyed by
+# (api_key, base_url, max_connections, max_keepalive_connections, keepalive_expiry).
+# Async clients are additionally scoped to the event loop that created them, since
+# httpx.AsyncClient connections cannot be reused across loops.
+_openai_clients = {}
+_async_openai_clients = weakref.WeakKeyDictionary()
+_openai_clients_lock = threading.Lock()
+
+# usage of the call currently in progress, filled in by the backends for metrics
+_call_usage = contextvars.ContextVar("llm_call_usage", default=None)
+# set while a caller streams only up to the first JSON value, so replay may serve a
+# response that was recorded from a stream stopped early
+_accept_partial = contextvars.ContextVar("llm_accept_partial", default=False)
+
+
+def _update_usage(**fields):
+    usage = _call_usage.get()
+    if usage is not None:
+        for name, value in fields.items():
+            setattr(usage, name, value)
+
+
+def _count_retry():
+    usage = _call_usage.get()
+    if usage is not None:
+        usage.retries += 1
+
+
+# DashScope serves batch jobs through its OpenAI compatible API
+DASHSCOPE_COMPATIBLE_BASE_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+
+
+def _resident_memory_bytes():
+    # current RSS on Linux, peak RSS elsewhere
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        import sys
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _get_openai_client(pool_key):
+    import httpx
+    from openai import OpenAI
+
+    with _openai_clients_lock:
+        client = _openai_clients.get(pool_key)
+        if client is None:
+            api_key, base_url, max_connections, max_keepalive, keepalive_expiry = pool_key
+            client = OpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                http_client=httpx.Client(
+                    limits=httpx.Limits(
+                        max_connections=max_connections,
+                        max_keepalive_connections=max_keepalive,
+                        keepalive_expiry=keepalive_expiry,
+                    )
+                ),
+            )
+            _openai_clients[pool_key] = client
+        return client
+
+
+def _get_async_openai_client(pool_key):
+    import httpx
+    from openai import AsyncOpenAI
+
+    loop = asyncio.get_running_loop()
+    with _openai_clients_lock:
+        loop_clients = _async_openai_clients.setdefault(loop, {})
+        client = loop_clients.get(pool_key)
+        if client is None:
+            api_key, base_url, max_connections, max_keepalive, keepalive_expiry = pool_key
+            client = AsyncOpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                http_client=httpx.AsyncClient(
+                    limits=httpx.Limits(
+                        max_connections=max_connections,
+                        max_keepalive_connections=max_keepalive,
+                        keepalive_expiry=keepalive_expiry,
+                    )
+                ),
+            )
+            loop_clients[pool_key] = client
+        return client
 
 
 class LlmClient:
-    def __init__(self, model="", model_path="", platform=""):
-        self.model = model
+    # sampling params sent to each backend, also part of the response cache key
+    OPENAI_SAMPLING_PARAMS = {"temperature": 0}
+    DASHSCOPE_SAMPLING_PARAMS = {"temperature": 0.8, "top_p": 0.8, "top_k": 50}
+    LOCAL_SAMPLING_PARAMS = {
+        "do_sample": True,
+        "temperature": 0.8,
+        "top_p": 0.8,
+        "top_k": 50,
+        "max_new_tokens": 2048,
+    }
+
+    def __init__(
+        self,
+        model="",
+        model_path="",
+        platform="",
+        max_connections=100,
+        max_keepalive_connections=20,
+        keepalive_expiry=30.0,
+        cache: LlmCache = None,
+        rate_limiter: ModelRateLimiter = None,
+        max_retries=8,
+        coalesce=True,
+        metrics_sink: MetricsSink = None,
+        cassette: Cassette = None,
+        record_platform="",
+        api_key=None,
+        base_url=None,
+        endpoints: List[LlmEndpoint] = None,
+        endpoint_strategy="round_robin",
+        prefix_cache_entries=8,
+        local_mode="",
+        local_dtype="bf16",
+        num_threads=None,
+    ):
+        self.model = model if model or not endpoints else endpoints[0].model
         self.model_path = model_path
+        self.cache = cache
+        # fall back to the platform's environment variables when not given
+        self.api_key = api_key
+        self.base_url = base_url
+        # identical concurrent requests share one outstanding call
+        self.single_flight = SingleFlight() if coalesce else None
+        # receives one LlmCallRecord per call when set
+        self.metrics_sink = metrics_sink
+        # calls to the same model share one limiter across the process unless given
+        self.rate_limiter = (
+            rate_limiter if rate_limiter is not None else get_rate_limiter(self.model)
+        )
+        self.max_retries = max_retries
         self.current_device = None
         self.tokenizer = None
+        # past_key_values of recent system prompts, only used with a local model
+        self.prefix_cache = None
+        # connection pool settings of the shared http clients
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
 
         platform_form_env = os.getenv("LLM_PLATFORM")
-        if platform != "":
+        if endpoints:
+            self.platform = "endpoints"
+        elif platform != "":
             self.platform = platform
         elif platform_form_env is not None:
             self.platform = platform_form_env
         else:
             self.platform = "dashscope"
+
+        # "record" forwards calls to record_platform and saves them to the cassette,
+        # "replay" serves every call from the cassette without touching the network
+        self.cassette = cassette
+        if self.platform in ("record", "replay"):
+            if self.cassette is None and os.getenv("LLM_CASSETTE") is not None:
+                self.cassette = Cassette(os.getenv("LLM_CASSETTE"))
+            if self.cassette is None:
+                raise ValueError(f"platform '{self.platform}' requires a cassette")
+        self.record_platform = record_platform or os.getenv("LLM_RECORD_PLATFORM", "dashscope")
+
+        # calls are balanced over the endpoints, each one has its own rate limiter
+        self.endpoint_pool = None
+        self._endpoint_clients = {}
+        if endpoints:
+            self.endpoint_pool = EndpointPool(endpoints, strategy=endpoint_strategy)
+            for endpoint in self.endpoint_pool.endpoints:
+                self._endpoint_clients[endpoint.name] = LlmClient(
+                    model=endpoint.model,
+                    platform=endpoint.platform,
+                    max_connections=max_connections,
+                    max_keepalive_connections=max_keepalive_connections,
+                    keepalive_expiry=keepalive_expiry,
+                    rate_limiter=get_rate_limiter(endpoint.name),
+                    coalesce=False,
+                    api_key=endpoint.api_key,
+                    base_url=endpoint.base_url,
+                )
+
+        # "default" loads fp16 weights onto cuda if available, "cpu_fast" targets CPU-only hosts
+        self.local_mode = local_mode or os.getenv("LLM_LOCAL_MODE", "default")
+        # seconds and resident bytes after loading the local model
+        self.load_stats = None
         if model_path != "":
-            # check current device
-            self.current_device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+            import torch
+            from transformers import AutoTokenizer
+
+            start = time.perf_counter()
             # load tokenizer
             self.tokenizer = AutoTokenizer.from_pretrained(model_path, trust_remote_code=True)
+            # left padding keeps every prompt adjacent to its generated tokens in a batch
+            self.tokenizer.padding_side = "left"
+            if self.tokenizer.pad_token is None:
+                self.tokenizer.pad_token = self.tokenizer.eos_token
             # load model
-            self.model = AutoModelForCausalLM.from_pretrained(
-                model_path, torch_dtype=torch.float16
-            ).to(self.current_device)
+            if self.local_mode == "cpu_fast":
+                self.model = self._load_local_model_cpu_fast(model_path, local_dtype, num_threads)
+            elif self.local_mode == "default":
+                from transformers import AutoModelForCausalLM
+
+                # check current device
+                self.current_device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+                self.model = AutoModelForCausalLM.from_pretrained(
+                    model_path, torch_dtype=torch.float16
+                ).to(self.current_device)
+            else:
+                raise ValueError(f"Unknown local_mode '{self.local_mode}'")
+            self.load_stats = {
+                "load_seconds": time.perf_counter() - start,
+                "rss_bytes": _resident_memory_bytes(),
+            }
+            print(
+                f"Loaded {model_path} ({self.local_mode}) in "
+                f"{self.load_stats['load_seconds']:.1f}s, "
+                f"RSS {self.load_stats['rss_bytes'] / 2**20:.0f} MiB"
+            )
+            if prefix_cache_entries > 0:
+                self.prefix_cache = PrefixKvCache(
+                    self.model, self.tokenizer, self.current_device, prefix_cache_entries
+                )
+
+    def _load_local_model_cpu_fast(self, model_path, local_dtype, num_threads):
+        import torch
+        from transformers import AutoModelForCausalLM
+
+        if local_dtype not in ("bf16", "int8"):
+            raise ValueError(f"Unknown local_dtype '{local_dtype}', expected 'bf16' or 'int8'")
+        self.current_device = torch.device("cpu")
+        # fp16 matmuls have no fast CPU kernels, and intra-op threads default to all cores
+        # including hyperthreads, which slows down small matmuls
+        torch.set_num_threads(num_threads or max(1, (os.cpu_count() or 2) // 2))
+        # low_cpu_mem_usage maps safetensors shards instead of materializing a random
+        # init first, so the weights are read from the page cache on demand
+        model = AutoModelForCausalLM.from_pretrained(
+            model_path,
+            torch_dtype=torch.bfloat16 if local_dtype == "bf16" else torch.float32,
+            low_cpu_mem_usage=True,
+        )
+        if local_dtype == "int8":
+            # weights of every Linear layer are stored as int8, activations quantized on the fly
+            model = torch.ao.quantization.quantize_dynamic(
+                model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+        return model.eval()
+
+    def _openai_pool_key(self):
+        return (
+            self.api_key or os.getenv("OPENAI_API_KEY"),
+            self.base_url or os.getenv("OPENAI_BASE_URL"),
+            self.max_connections,
+            self.max_keepalive_connections,
+            self.keepalive_expiry,
+        )
+
+    def _backend_platform(self):
+        return self.record_platform if self.platform == "record" else self.platform
+
+    def _sampling_params(self):
+        if self.model_path != "":
+            return self.LOCAL_SAMPLING_PARAMS
+        elif self._backend_platform() == "openai":
+            return self.OPENAI_SAMPLING_PARAMS
+        else:
+            return self.DASHSCOPE_SAMPLING_PARAMS
+
+    def _model_name(self):
+        return self.model_path if self.model_path != "" else self.model
+
+    def _request_key(self, messages):
+        return LlmCache.make_key(
+            self.platform, self._model_name(), messages, self._sampling_params()
+        )
+
+    def _record_call(self, call, messages, *args):
+        if self.metrics_sink is None:
+            return call(messages, *args)
+        usage = CallUsage()
+        token = _call_usage.set(usage)
+        start = time.perf_counter()
+        output = None
+        try:
+            output = call(messages, *args)
+            return output
+        finally:
+            _call_usage.reset(token)
+            self._emit_record(messages, output, usage, time.perf_counter() - start)
+
+    async def _arecord_call(self, call, messages, *args):
+        if self.metrics_sink is None:
+            return await call(messages, *args)
+        usage = CallUsage()
+        token = _call_usage.set(usage)
+        start = time.perf_counter()
+        output = None
+        try:
+            output = await call(messages, *args)
+            return output
+        finally:
+            _call_usage.reset(token)
+            self._emit_record(messages, output, usage, time.perf_counter() - start)
+
+    def _emit_record(self, messages, output, usage, latency):
+        if usage.cache_status in ("hit", "coalesced"):
+            # nothing was paid for this call
+            prompt_tokens, completion_tokens = 0, 0
+        else:
+            prompt_tokens = usage.prompt_tokens
+            if prompt_tokens is None:
+                prompt_tokens = self._count_prompt_tokens(messages)
+            completion_tokens = usage.completion_tokens
+            if completion_tokens is None:
+                completion_tokens = self._count_completion_tokens(output or "")
+        self.metrics_sink.record(
+            LlmCallRecord(
+                stage=current_stage(),
+                platform=usage.platform or (self.platform if self.model_path == "" else "local"),
+                model=usage.model or self._model_name(),
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                latency=latency,
+                retries=usage.retries,
+                cache_status=usage.cache_status,
+                success=bool(output),
+                timestamp=time.time(),
+            )
+        )
+
+    def _count_prompt_tokens(self, messages):
+        if self.tokenizer is not None:
+            return len(self.tokenizer.apply_chat_template(messages, tokenize=True))
+        return estimate_tokens(messages)
+
+    def _count_completion_tokens(self, output):
+        if self.tokenizer is not None:
+            return len(self.tokenizer.encode(output, add_special_tokens=False))
+        return len(output) // 4
+
+    def count_tokens(self, text):
+        """Token count of text, exact with a local tokenizer and estimated otherwise."""
+        if self.tokenizer is not None:
+            return len(self.tokenizer.encode(text, add_special_tokens=False))
+        return len(text) // 4 + 1
+
+    def _cache_status_on_miss(self):
+        return "miss" if self.cache is not None else "disabled"
+
+    def invalidate(self, messages):
+        """Drop the cached response of messages, so the next call asks the LLM again.
+
+        Callers use this after rejecting an output, e.g. one that does not parse, which
+        would otherwise be served from the cache on every retry and rerun.
+        """
+        if self.cache is not None:
+            request_key = self._request_key(messages)
+            self.cache.delete(
+                request_key,
+                self._until_json_key(request_key, True),
+                self._until_json_key(request_key, False),
+            )
 
     def call_with_messages(self, messages):
+        return self._record_call(self._call_with_messages, messages)
+
+    def _call_with_messages(self, messages):
+        request_key = self._request_key(messages)
+        if self.cache is not None:
+            cached = self.cache.get(request_key)
+            if cached is not None:
+                _update_usage(cache_status="hit")
+                return cached
+
+        if self.single_flight is None:
+            return self._call_uncached(messages, request_key)
+        # overwritten with the real status if this call ends up executing the request
+        _update_usage(cache_status="coalesced")
+        return self.single_flight.do(
+            request_key, lambda: self._call_uncached(messages, request_key)
+        )
+
+    def _call_uncached(self, messages, request_key):
+        _update_usage(cache_status=self._cache_status_on_miss())
         if self.model_path == "":
-            output = self.call_with_messages_online(messages)
+            output = self._call_with_rate_limit(messages)
         else:
             output = self.call_with_messages_local(messages)
+
+        if self.cache is not None and output:
+            self.cache.put(request_key, output)
         return output
 
-    def call_with_messages_online(self, messages):
+    def call_with_messages_batch(
+        self, messages_list, batch_size=8, until_json=False, expect_list=True
+    ):
+        """Call the LLM with a list of conversations and return the outputs in order.
+
+        With a local model, uncached conversations are left-padded and generated
+        batch_size at a time in a single forward pass. Remote platforms are called
+        one conversation at a time, streaming until the first JSON value if until_json.
+        """
+        if self.model_path == "":
+            if until_json:
+                return [
+                    self.call_with_messages_until_json(messages, expect_list)
+                    for messages in messages_list
+                ]
+            return [self.call_with_messages(messages) for messages in messages_list]
+
+        outputs = [None] * len(messages_list)
+        pending = []
+        for i, messages in enumerate(messages_list):
+            request_key = self._request_key(messages)
+            cached = self.cache.get(request_key) if self.cache is not None else None
+            if cached is not None:
+                outputs[i] = cached
+            else:
+                pending.append((i, messages, request_key))
+
+        if self.metrics_sink is not None:
+            for i, messages in enumerate(messages_list):
+                if outputs[i] is not None:
+                    self._emit_record(messages, outputs[i], CallUsage(cache_status="hit"), 0.0)
+
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start : start + batch_size]
+            batch_start = time.perf_counter()
+            batch_outputs = self.call_with_messages_local_batch([item[1] for item in batch])
+            batch_latency = time.perf_counter() - batch_start
+            for (i, messages, request_key), output in zip(batch, batch_outputs):
+                outputs[i] = output
+                if self.cache is not None and output:
+                    self.cache.put(request_key, output)
+                if self.metrics_sink is not None:
+                    usage = CallUsage(cache_status=self._cache_status_on_miss())
+                    self._emit_record(messages, output, usage, batch_latency)
+        return outputs
+
+    def call_with_messages_batch_job(
+        self,
+        messages_list,
+        job_name="batch",
+        work_dir=".llm_batches",
+        backend: BatchBackend = None,
+        poll_interval=30.0,
+        timeout=None,
+    ):
+        """Answer a list of conversations through an offline provider batch job.
+
+        Uncached conversations are written to batch JSONL files under work_dir, submitted,
+        polled until finished and mapped back by custom_id. Job ids are kept in a manifest,
+        so rerunning the same requests with the same job_name resumes polling instead of
+        submitting again; jobs the backend no longer knows are submitted again. The
+        manifest is removed once every job finished and its results were collected, so
+        a later run submits the conversations that are still unanswered as a new job.
+        Conversations without a result get an empty string.
+        """
+        backend = backend if backend is not None else self._default_batch_backend()
+        request_keys = [self._request_key(messages) for messages in messages_list]
+        results = {}
+        pending = {}
+        for request_key, messages in zip(request_keys, messages_list):
+            cached = self.cache.get(request_key) if self.cache is not None else None
+            if cached is not None:
+                results[request_key] = cached
+            else:
+                pending.setdefault(request_key, messages)
+
+        if pending:
+            os.makedirs(work_dir, exist_ok=True)
+            batch_results = self._run_batch_jobs(
+                pending, backend, job_name, work_dir, poll_interval, timeout
+            )
+            for request_key, output in batch_results.items():
+                if request_key in pending and output:
+                    results[request_key] = output
+                    if self.cache is not None:
+                        self.cache.put(request_key, output)
+
+        outputs = [results.get(request_key) or "" for request_key in request_keys]
+        failed = sum(1 for output in outputs if not output)
+        if failed:
+            print(f"Failed! {failed} of {len(outputs)} batch requests got no response")
+        return outputs
+
+    def _default_batch_backend(self):
         if self.platform == "openai":
+            return OpenAIBatchBackend(_get_openai_client(self._openai_pool_key()))
+        if self.platform == "dashscope":
+            pool_key = (
+                self.api_key or os.getenv("DASHSCOPE_API_KEY"),
+                self.base_url or DASHSCOPE_COMPATIBLE_BASE_URL,
+                *self._openai_pool_key()[2:],
+            )
+            return OpenAIBatchBackend(_get_openai_client(pool_key))
+        if self.platform == "endpoints":
+            # the job goes to the first endpoint, whose model the batch bodies name
+            endpoint = self.endpoint_pool.endpoints[0]
+            if endpoint.platform not in ("openai", "dashscope"):
+                raise ValueError(
+                    f"Endpoint '{endpoint.name}' does not support batch jobs, "
+                    "put an openai or dashscope endpoint first or pass a backend"
+                )
+            return self._endpoint_clients[endpoint.name]._default_batch_backend()
+        # local models, replay and record are answered in process
+        return LocalBatchBackend(self)
+
+    def _batch_body(self, messages):
+        # top_k is not part of the chat completions API
+        params = {
+            k: v for k, v in self._sampling_params().items() if k in ("temperature", "top_p")
+        }
+        return {"model": self.model, "messages": messages, **params}
+
+    def _run_batch_jobs(self, pending, backend, job_name, work_dir, poll_interval, timeout):
+        # request keys double as custom_ids, so results map back whatever the order
+        request_keys = sorted(pending)
+        digest = hashlib.sha256("".join(request_keys).encode("utf-8")).hexdigest()
+        manifest_path = os.path.join(work_dir, f"{job_name}.manifest.json")
+        manifest = None
+        if os.path.exists(manifest_path):
+            with open(manifest_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest["digest"] != digest:
+                print(f"Requests of batch {job_name} changed, submitting a new job")
+                manifest = None
+
+        def save_manifest():
+            with open(manifest_path, "w", encoding="utf-8") as f:
+                json.dump(manifest, f, indent=2)
+
+        if manifest is None:
+            jobs = []
+            for start in range(0, len(request_keys), MAX_REQUESTS_PER_FILE):
+                part = start // MAX_REQUESTS_PER_FILE
+                input_path = os.path.join(work_dir, f"{job_name}.{part}.input.jsonl")
+                write_batch_input(
+                    input_path,
+                    (
+                        (request_key, self._batch_body(pending[request_key]))
+                        for request_key in request_keys[start : start + MAX_REQUESTS_PER_FILE]
+                    ),
+                )
+                jobs.append(
+                    {
+                        "job_id": backend.submit(input_path),
+                        "input": input_path,
+                        "output": os.path.join(work_dir, f"{job_name}.{part}.output.jsonl"),
+                    }
+                )
+            manifest = {"digest": digest, "jobs": jobs}
+            save_manifest()
+
+        def job_status(job):
+            try:
+                return backend.status(job["job_id"])
+            except BatchJobNotFound:
+                print(f"Batch job {job['job_id']} is unknown to the backend, submitting again")
+                job["job_id"] = backend.submit(job["input"])
+                save_manifest()
+                return backend.status(job["job_id"])
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        results = {}
+        for job in manifest["jobs"]:
+            status = job_status(job)
+            while status not in TERMINAL_STATUSES:
+                if deadline is not None and time.monotonic() > deadline:
+                    raise TimeoutError(f"Batch job {job['job_id']} did not finish in {timeout}s")
+                time.sleep(poll_interval)
+                status = job_status(job)
+            if status != "completed":
+                print(f"Failed! Batch job {job['job_id']} ended with status {status}")
+            if backend.download(job["job_id"], job["output"]):
+                results.update(read_batch_output(job["output"]))
+        # every job is finished, a rerun submits what is still unanswered as a new job
+        os.remove(manifest_path)
+        return results
+
+    async def acall_with_messages(self, messages):
+        """Asynchronous counterpart of call_with_messages.
+
+        Remote platforms are called through native async clients sharing a pooled
+        connection per event loop, local models run in a worker thread.
+        """
+        return await self._arecord_call(self._acall_with_messages, messages)
+
+    async def _acall_with_messages(self, messages):
+        request_key = self._request_key(messages)
+        if self.cache is not None:
+            cached = await asyncio.to_thread(self.cache.get, request_key)
+            if cached is not None:
+                _update_usage(cache_status="hit")
+                return cached
+
+        if self.single_flight is None:
+            return await self._acall_uncached(messages, request_key)
+        _update_usage(cache_status="coalesced")
+        return await self.single_flight.ado(
+            request_key, lambda: self._acall_uncached(messages, request_key)
+        )
+
+    async def _acall_uncached(self, messages, request_key):
+        _update_usage(cache_status=self._cache_status_on_miss())
+        if self.model_path == "":
+            output = await self._acall_with_rate_limit(messages)
+        else:
+            output = await asyncio.to_thread(self.call_with_messages_local, messages)
+
+        if self.cache is not None and output:
+            await asyncio.to_thread(self.cache.put, request_key, output)
+        return output
+
+    def call_with_messages_until_json(self, messages, expect_list=True):
+        """Stream the response and stop as soon as the first JSON list/object is complete.
+
+        Returns the response text up to the closing bracket, or the whole response if no
+        complete JSON value was produced.
+        """
+        return self._record_call(self._call_with_messages_until_json, messages, expect_list)
+
+    def _call_with_messages_until_json(self, messages, expect_list):
+        request_key = self._request_key(messages)
+        if self.cache is not None:
+            # a complete response serves as well as one cut at the first JSON value
+            cached = self.cache.get_first(
+                [request_key, self._until_json_key(request_key, expect_list)]
+            )
+            if cached is not None:
+                _update_usage(cache_status="hit")
+                return cached
+
+        if self.single_flight is None:
+            return self._call_until_json_uncached(messages, expect_list, request_key)
+        _update_usage(cache_status="coalesced")
+        return self.single_flight.do(
+            self._until_json_key(request_key, expect_list),
+            lambda: self._call_until_json_uncached(messages, expect_list, request_key),
+        )
+
+    @staticmethod
+    def _until_json_key(request_key, expect_list):
+        # a response cut at the first JSON value must never be served to a full call,
+        # neither by single flight nor from the cache
+        return f"{request_key}:until_json:{expect_list}"
+
+    def _call_until_json_uncached(self, messages, expect_list, request_key):
+        _update_usage(cache_status=self._cache_status_on_miss())
+        extractor = JsonStreamExtractor(expect_list)
+        token = _accept_partial.set(True)
+        stream = self.stream_with_messages(messages)
+        try:
+            for chunk in stream:
+                if extractor.feed(chunk):
+                    break
+        finally:
+            # closing the stream stops the generation of the remaining tokens
+            stream.close()
+            _accept_partial.reset(token)
+        output = extractor.output()
+
+        if self.cache is not None and output:
+            self.cache.put(self._until_json_key(request_key, expect_list), output)
+        return output
+
+    async def acall_with_messages_until_json(self, messages, expect_list=True):
+        """Asynchronous counterpart of call_with_messages_until_json."""
+        return await self._arecord_call(
+            self._acall_with_messages_until_json, messages, expect_list
+        )
+
+    async def _acall_with_messages_until_json(self, messages, expect_list):
+        if self.model_path != "":
+            return await asyncio.to_thread(
+                self._call_with_messages_until_json, messages, expect_list
+            )
+
+        request_key = self._request_key(messages)
+        if self.cache is not None:
+            cached = await asyncio.to_thread(
+                self.cache.get_first,
+                [request_key, self._until_json_key(request_key, expect_list)],
+            )
+            if cached is not None:
+                _update_usage(cache_status="hit")
+                return cached
+
+        if self.single_flight is None:
+            return await self._acall_until_json_uncached(messages, expect_list, request_key)
+        _update_usage(cache_status="coalesced")
+        return await self.single_flight.ado(
+            self._until_json_key(request_key, expect_list),
+            lambda: self._acall_until_json_uncached(messages, expect_list, request_key),
+        )
+
+    async def _acall_until_json_uncached(self, messages, expect_list, request_key):
+        _update_usage(cache_status=self._cache_status_on_miss())
+        extractor = JsonStreamExtractor(expect_list)
+        token = _accept_partial.set(True)
+        stream = self.astream_with_messages(messages)
+        try:
+            async for chunk in stream:
+                if extractor.feed(chunk):
+                    break
+        finally:
+            await stream.aclose()
+            _accept_partial.reset(token)
+        output = extractor.output()
+
+        if self.cache is not None and output:
+            await asyncio.to_thread(
+                self.cache.put, self._until_json_key(request_key, expect_list), output
+            )
+        return output
+
+    def stream_with_messages(self, messages):
+        """Yield the response text chunk by chunk, closing the generator stops generation."""
+        if self.model_path != "":
+            yield from self.stream_with_messages_local(messages)
+            return
+        if self.endpoint_pool is not None:
+            yield from self._stream_with_failover(messages)
+            return
+
+        estimated_tokens = estimate_tokens(messages)
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire(estimated_tokens)
+            throttled = False
+            completion_chars = 0
+            try:
+                for chunk in self.stream_with_messages_online(messages):
+                    completion_chars += len(chunk)
+                    yield chunk
+                return
+            except RateLimitExceeded as e:
+                throttled = True
+                if completion_chars:
+                    # chunks were already handed out, a restart would duplicate them
+                    raise
+                _count_retry()
+                delay = self._retry_delay(attempt)
+                print(f"{e} too many request, ready to retry in {delay:.1f} seconds")
+            finally:
+                self.rate_limiter.release(throttled, completion_tokens=completion_chars // 4)
+            time.sleep(delay)
+        print(f"Failed! Rate limited after {self.max_retries} retries", messages[-1]["content"])
+
+    async def astream_with_messages(self, messages):
+        """Asynchronous counterpart of stream_with_messages for remote platforms."""
+        if self.endpoint_pool is not None:
+            async for chunk in self._astream_with_failover(messages):
+                yield chunk
+            return
+        estimated_tokens = estimate_tokens(messages)
+        for attempt in range(self.max_retries + 1):
+            await self.rate_limiter.aacquire(estimated_tokens)
+            throttled = False
+            completion_chars = 0
+            try:
+                async for chunk in self.astream_with_messages_online(messages):
+                    completion_chars += len(chunk)
+                    yield chunk
+                return
+            except RateLimitExceeded as e:
+                throttled = True
+                if completion_chars:
+                    # chunks were already handed out, a restart would duplicate them
+                    raise
+                _count_retry()
+                delay = self._retry_delay(attempt)
+                print(f"{e} too many request, ready to retry in {delay:.1f} seconds")
+            finally:
+                self.rate_limiter.release(throttled, completion_tokens=completion_chars // 4)
+            await asyncio.sleep(delay)
+        print(f"Failed! Rate limited after {self.max_retries} retries", messages[-1]["content"])
+
+    def _retry_delay(self, attempt):
+        # exponential backoff with jitter, capped at one minute
+        return min(60.0, 2**attempt) * random.uniform(0.5, 1.0)
+
+    def _call_with_rate_limit(self, messages):
+        if self.endpoint_pool is not None:
+            return self._call_with_failover(messages)
+        estimated_tokens = estimate_tokens(messages)
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire(estimated_tokens)
+            try:
+                output = self.call_with_messages_online(messages)
+            except RateLimitExceeded as e:
+                self.rate_limiter.release(throttled=True)
+                _count_retry()
+                delay = self._retry_delay(attempt)
+                print(f"{e} too many request, ready to retry in {delay:.1f} seconds")
+                time.sleep(delay)
+                continue
+            except BaseException:
+                self.rate_limiter.release()
+                raise
+            self.rate_limiter.release(completion_tokens=len(output or "") // 4)
+            return output
+        print(f"Failed! Rate limited after {self.max_retries} retries", messages[-1]["content"])
+        return ""
+
+    async def _acall_with_rate_limit(self, messages):
+        if self.endpoint_pool is not None:
+            return await self._acall_with_failover(messages)
+        estimated_tokens = estimate_tokens(messages)
+        for attempt in range(self.max_retries + 1):
+            await self.rate_limiter.aacquire(estimated_tokens)
+            try:
+                output = await self.acall_with_messages_online(messages)
+            except RateLimitExceeded as e:
+                self.rate_limiter.release(throttled=True)
+                _count_retry()
+                delay = self._retry_delay(attempt)
+                print(f"{e} too many request, ready to retry in {delay:.1f} seconds")
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                self.rate_limiter.release()
+                raise
+            self.rate_limiter.release(completion_tokens=len(output or "") // 4)
+            return output
+        print(f"Failed! Rate limited after {self.max_retries} retries", messages[-1]["content"])
+        return ""
+
+    def _failover_delay(self, failed, endpoint, attempt):
+        # try every other endpoint first, back off once all of them failed in a row
+        failed.add(endpoint.name)
+        if len(failed) < len(self.endpoint_pool):
+            return 0.0
+        failed.clear()
+        return self._retry_delay(attempt)
+
+    def _call_with_failover(self, messages):
+        estimated_tokens = estimate_tokens(messages)
+        failed = set()
+        for attempt in range(self.max_retries + 1):
+            endpoint = self.endpoint_pool.acquire(exclude=failed)
+            client = self._endpoint_clients[endpoint.name]
+            client.rate_limiter.acquire(estimated_tokens)
+            throttled = False
+            output = ""
+            try:
+                output = client.call_with_messages_online(messages)
+            except RateLimitExceeded as e:
+                throttled = True
+                print(f"{e} endpoint {endpoint.name} is throttled, failing over")
+            finally:
+                client.rate_limiter.release(throttled, completion_tokens=len(output or "") // 4)
+                self.endpoint_pool.release(endpoint, success=bool(output))
+            if output:
+                _update_usage(platform=endpoint.platform, model=endpoint.model)
+                return output
+            _count_retry()
+            delay = self._failover_delay(failed, endpoint, attempt)
+            if delay:
+                time.sleep(delay)
+        print(f"Failed! All endpoints failed after {self.max_retries} retries")
+        return ""
+
+    async def _acall_with_failover(self, messages):
+        estimated_tokens = estimate_tokens(messages)
+        failed = set()
+        for attempt in range(self.max_retries + 1):
+            endpoint = self.endpoint_pool.acquire(exclude=failed)
+            client = self._endpoint_clients[endpoint.name]
+            await client.rate_limiter.aacquire(estimated_tokens)
+            throttled = False
+            output = ""
+            try:
+                output = await client.acall_with_messages_online(messages)
+            except RateLimitExceeded as e:
+                throttled = True
+                print(f"{e} endpoint {endpoint.name} is throttled, failing over")
+            finally:
+                client.rate_limiter.release(throttled, completion_tokens=len(output or "") // 4)
+                self.endpoint_pool.release(endpoint, success=bool(output))
+            if output:
+                _update_usage(platform=endpoint.platform, model=endpoint.model)
+                return output
+            _count_retry()
+            delay = self._failover_delay(failed, endpoint, attempt)
+            if delay:
+                await asyncio.sleep(delay)
+        print(f"Failed! All endpoints failed after {self.max_retries} retries")
+        return ""
+
+    def _stream_with_failover(self, messages):
+        estimated_tokens = estimate_tokens(messages)
+        failed = set()
+        for attempt in range(self.max_retries + 1):
+            endpoint = self.endpoint_pool.acquire(exclude=failed)
+            client = self._endpoint_clients[endpoint.name]
+            client.rate_limiter.acquire(estimated_tokens)
+            throttled = False
+            completion_chars = 0
+            try:
+                for chunk in client.stream_with_messages_online(messages):
+                    if not completion_chars:
+                        _update_usage(platform=endpoint.platform, model=endpoint.model)
+                    completion_chars += len(chunk)
+                    yield chunk
+            except RateLimitExceeded as e:
+                throttled = True
+                if completion_chars:
+                    raise
+                print(f"{e} endpoint {endpoint.name} is throttled, failing over")
+            finally:
+                client.rate_limiter.release(throttled, completion_tokens=completion_chars // 4)
+                self.endpoint_pool.release(endpoint, success=completion_chars > 0)
+            if completion_chars:
+                return
+            _count_retry()
+            delay = self._failover_delay(failed, endpoint, attempt)
+            if delay:
+                time.sleep(delay)
+        print(f"Failed! All endpoints failed after {self.max_retries} retries")
+
+    async def _astream_with_failover(self, messages):
+        estimated_tokens = estimate_tokens(messages)
+        failed = set()
+        for attempt in range(self.max_retries + 1):
+            endpoint = self.endpoint_pool.acquire(exclude=failed)
+            client = self._endpoint_clients[endpoint.name]
+            await client.rate_limiter.aacquire(estimated_tokens)
+            throttled = False
+            completion_chars = 0
+            try:
+                async for chunk in client.astream_with_messages_online(messages):
+                    if not completion_chars:
+                        _update_usage(platform=endpoint.platform, model=endpoint.model)
+                    completion_chars += len(chunk)
+                    yield chunk
+            except RateLimitExceeded as e:
+                throttled = True
+                if completion_chars:
+                    raise
+                print(f"{e} endpoint {endpoint.name} is throttled, failing over")
+            finally:
+                client.rate_limiter.release(throttled, completion_tokens=completion_chars // 4)
+                self.endpoint_pool.release(endpoint, success=completion_chars > 0)
+            if completion_chars:
+                return
+            _count_retry()
+            delay = self._failover_delay(failed, endpoint, attempt)
+            if delay:
+                await asyncio.sleep(delay)
+        print(f"Failed! All endpoints failed after {self.max_retries} retries")
+
+    def call_with_messages_online(self, messages):
+        if self.platform == "replay":
+            return self.cassette.replay(self.model, messages)
+        elif self.platform == "record":
+            output = self._call_platform(self.record_platform, messages)
+            if output:
+                self.cassette.record(self.model, messages, output)
+            return output
+        return self._call_platform(self.platform, messages)
+
+    def _call_platform(self, platform, messages):
+        if platform == "openai":
             return self.call_with_messages_online_for_openai(messages)
-        elif self.platform == "dashscope":
+        elif platform == "dashscope":
             return self.call_with_messages_online_for_dashscope(messages)
         else:
-            print(f"Unsupposed platform:{self.platform}")
+            print(f"Unsupposed platform:{platform}")
             return ""
 
+    async def acall_with_messages_online(self, messages):
+        if self.platform == "replay":
+            return await self.cassette.areplay(self.model, messages)
+        elif self.platform == "record":
+            output = await self._acall_platform(self.record_platform, messages)
+            if output:
+                self.cassette.record(self.model, messages, output)
+            return output
+        return await self._acall_platform(self.platform, messages)
+
+    async def _acall_platform(self, platform, messages):
+        if platform == "openai":
+            return await self.acall_with_messages_online_for_openai(messages)
+        elif platform == "dashscope":
+            return await self.acall_with_messages_online_for_dashscope(messages)
+        else:
+            print(f"Unsupposed platform:{platform}")
+            return ""
+
+    def stream_with_messages_online(self, messages):
+        if self.platform == "replay":
+            response = self.cassette.replay(self.model, messages, _accept_partial.get())
+            yield from self._split_chunks(response)
+        elif self.platform == "record":
+            chunks = []
+            finished = False
+            try:
+                for chunk in self._stream_platform(self.record_platform, messages):
+                    chunks.append(chunk)
+                    yield chunk
+                finished = True
+            finally:
+                # record what the caller consumed, a stream stopped early as partial
+                if chunks:
+                    self.cassette.record(
+                        self.model, messages, "".join(chunks), partial=not finished
+                    )
+        else:
+            yield from self._stream_platform(self.platform, messages)
+
+    def _stream_platform(self, platform, messages):
+        if platform == "openai":
+            yield from self.stream_with_messages_online_for_openai(messages)
+        elif platform == "dashscope":
+            yield from self.stream_with_messages_online_for_dashscope(messages)
+        else:
+            print(f"Unsupposed platform:{platform}")
+
+    async def astream_with_messages_online(self, messages):
+        if self.platform == "replay":
+            response = await self.cassette.areplay(self.model, messages, _accept_partial.get())
+            for chunk in self._split_chunks(response):
+                yield chunk
+        elif self.platform == "record":
+            chunks = []
+            finished = False
+            try:
+                async for chunk in self._astream_platform(self.record_platform, messages):
+                    chunks.append(chunk)
+                    yield chunk
+                finished = True
+            finally:
+                if chunks:
+                    self.cassette.record(
+                        self.model, messages, "".join(chunks), partial=not finished
+                    )
+        else:
+            async for chunk in self._astream_platform(self.platform, messages):
+                yield chunk
+
+    async def _astream_platform(self, platform, messages):
+        if platform == "openai":
+            async for chunk in self.astream_with_messages_online_for_openai(messages):
+                yield chunk
+        elif platform == "dashscope":
+            async for chunk in self.astream_with_messages_online_for_dashscope(messages):
+                yield chunk
+        else:
+            print(f"Unsupposed platform:{platform}")
+
+    @staticmethod
+    def _split_chunks(text, chunk_size=16):
+        # replayed responses are streamed in small pieces like a real provider would
+        return [text[i : i + chunk_size] for i in range(0, len(text), chunk_size)]
+
+    def stream_with_messages_local(self, messages):
+        import torch
+        from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+
+        stop_event = threading.Event()
+
+        class StopOnEvent(StoppingCriteria):
+            def __call__(self, input_ids, scores, **kwargs):
+                return torch.full(
+                    (input_ids.shape[0],), stop_event.is_set(), device=input_ids.device
+                )
+
+        inputs = self.tokenizer.apply_chat_template(
+            messages, tokenize=True, return_dict=True, return_tensors="pt"
+        ).to(self.current_device)
+        prefix_kwargs = self._prefix_cache_kwargs(messages, inputs)
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        generation_error = []
+
+        def generate(**kwargs):
+            try:
+                self.model.generate(**kwargs)
+            except BaseException as e:
+                generation_error.append(e)
+                # the consumer would wait for the next chunk forever otherwise
+                streamer.end()
+
+        generation_thread = threading.Thread(
+            target=generate,
+            kwargs=dict(
+                **inputs,
+                **prefix_kwargs,
+                **self.LOCAL_SAMPLING_PARAMS,
+                pad_token_id=self.tokenizer.eos_token_id,
+                eos_token_id=self.tokenizer.eos_token_id,
+                streamer=streamer,
+                stopping_criteria=StoppingCriteriaList([StopOnEvent()]),
+            ),
+        )
+        generation_thread.start()
+        finished = False
+        try:
+            for chunk in streamer:
+                if chunk:
+                    yield chunk
+            finished = True
+        finally:
+            # stop generating once the consumer is done, then drain the streamer up to
+            # its end signal, which a finished iteration has already consumed
+            stop_event.set()
+            if not finished:
+                for _ in streamer:
+                    pass
+            generation_thread.join()
+        if generation_error:
+            raise generation_error[0]
+
+    def _prefix_cache_kwargs(self, messages, inputs):
+        # only the user turn is prefilled when the system prompt was encoded before
+        if self.prefix_cache is None:
+            return {}
+        past_key_values = self.prefix_cache.lookup(messages, inputs["input_ids"])
+        return {} if past_key_values is None else {"past_key_values": past_key_values}
+
     def call_with_messages_local(self, messages):
         # generate content
         inputs = self.tokenizer.apply_chat_template(
@@ -59,13 +1174,10 @@ class LlmClient:
         # add more args
         output = self.model.generate(
             **inputs,
-            do_sample=True,
-            temperature=0.8,
-            top_p=0.8,
-            top_k=50,
+            **self._prefix_cache_kwargs(messages, inputs),
+            **self.LOCAL_SAMPLING_PARAMS,
             pad_token_id=self.tokenizer.eos_token_id,
             eos_token_id=self.tokenizer.eos_token_id,
-            max_new_tokens=2048,
         )
 
         # deal with output and return
@@ -75,53 +1187,219 @@ class LlmClient:
 
         return output
 
+    def call_with_messages_local_batch(self, messages_list):
+        if len(messages_list) == 1:
+            # a single prompt needs no padding and can reuse the cached system prompt
+            return [self.call_with_messages_local(messages_list[0])]
+
+        # render prompts and left pad them to a common length
+        prompts = [
+            self.tokenizer.apply_chat_template(messages, tokenize=False)
+            for messages in messages_list
+        ]
+        inputs = self.tokenizer(
+            prompts, return_tensors="pt", padding=True, add_special_tokens=False
+        ).to(self.current_device)
+
+        # finished sequences are filled with pad tokens until the whole batch stops
+        output = self.model.generate(
+            **inputs,
+            **self.LOCAL_SAMPLING_PARAMS,
+            pad_token_id=self.tokenizer.pad_token_id,
+            eos_token_id=self.tokenizer.eos_token_id,
+        )
+
+        # strip the shared prompt width and decode every sequence on its own
+        prompt_length = inputs["input_ids"].shape[1]
+        return [
+            self.tokenizer.decode(sequence[prompt_length:], skip_special_tokens=True)
+            for sequence in output
+        ]
+
     def call_with_messages_online_for_openai(self, messages):
+        import openai
+
         try:
-            openai_client = OpenAI(
-                api_key=os.getenv("OPENAI_API_KEY"), base_url=os.getenv("OPENAI_BASE_URL")
-            )
+            openai_client = _get_openai_client(self._openai_pool_key())
             response = openai_client.chat.completions.create(
-                model=self.model, messages=messages, temperature=0
+                model=self.model, messages=messages, **self.OPENAI_SAMPLING_PARAMS
             )
+            self._report_openai_usage(response.usage)
             return response.choices[0].message.content
-        except openai.RateLimitError:
-            print("there are too many request,ready to retry in 1 second")
-            time.sleep(1)
-            print("begin to retry")
-            return self.call_with_messages_online_for_openai(messages)
-        except OpenAIError:
-            print("Failed!", messages[1]["content"])
+        except openai.RateLimitError as e:
+            raise RateLimitExceeded(str(e)) from e
+        except openai.OpenAIError:
+            print("Failed!", messages[-1]["content"])
+            return ""
+
+    async def acall_with_messages_online_for_openai(self, messages):
+        import openai
+
+        try:
+            openai_client = _get_async_openai_client(self._openai_pool_key())
+            response = await openai_client.chat.completions.create(
+                model=self.model, messages=messages, **self.OPENAI_SAMPLING_PARAMS
+            )
+            self._report_openai_usage(response.usage)
+            return response.choices[0].message.content
+        except openai.RateLimitError as e:
+            raise RateLimitExceeded(str(e)) from e
+        except openai.OpenAIError:
+            print("Failed!", messages[-1]["content"])
+            return ""
 
     def call_with_messages_online_for_dashscope(self, messages):
+        from dashscope import Generation
+
         response = Generation.call(
             model=self.model,
             messages=messages,
+            api_key=self.api_key,
+            seed=random.randint(1, 10000),
+            **self.DASHSCOPE_SAMPLING_PARAMS,
+            result_format="message",
+        )
+        return self._handle_dashscope_response(response, messages)
+
+    async def acall_with_messages_online_for_dashscope(self, messages):
+        from dashscope import AioGeneration
+
+        response = await AioGeneration.call(
+            model=self.model,
+            messages=messages,
+            api_key=self.api_key,
             seed=random.randint(1, 10000),
-            temperature=0.8,
-            top_p=0.8,
-            top_k=50,
+            **self.DASHSCOPE_SAMPLING_PARAMS,
             result_format="message",
         )
+        return self._handle_dashscope_response(response, messages)
+
+    def stream_with_messages_online_for_openai(self, messages):
+        import openai
+
+        try:
+            openai_client = _get_openai_client(self._openai_pool_key())
+            stream = openai_client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                stream=True,
+                stream_options={"include_usage": True},
+                **self.OPENAI_SAMPLING_PARAMS,
+            )
+        except openai.RateLimitError as e:
+            raise RateLimitExceeded(str(e)) from e
+        except openai.OpenAIError:
+            print("Failed!", messages[-1]["content"])
+            return
+        try:
+            for chunk in stream:
+                self._report_openai_usage(chunk.usage)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except openai.OpenAIError:
+            print("Failed!", messages[-1]["content"])
+        finally:
+            stream.close()
+
+    async def astream_with_messages_online_for_openai(self, messages):
+        import openai
+
+        try:
+            openai_client = _get_async_openai_client(self._openai_pool_key())
+            stream = await openai_client.chat.completions.create(
+                model=self.model,
+                messages=messages,
+                stream=True,
+                stream_options={"include_usage": True},
+                **self.OPENAI_SAMPLING_PARAMS,
+            )
+        except openai.RateLimitError as e:
+            raise RateLimitExceeded(str(e)) from e
+        except openai.OpenAIError:
+            print("Failed!", messages[-1]["content"])
+            return
+        try:
+            async for chunk in stream:
+                self._report_openai_usage(chunk.usage)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        except openai.OpenAIError:
+            print("Failed!", messages[-1]["content"])
+        finally:
+            await stream.close()
+
+    def stream_with_messages_online_for_dashscope(self, messages):
+        from dashscope import Generation
+
+        responses = Generation.call(
+            model=self.model,
+            messages=messages,
+            api_key=self.api_key,
+            seed=random.randint(1, 10000),
+            **self.DASHSCOPE_SAMPLING_PARAMS,
+            result_format="message",
+            stream=True,
+            incremental_output=True,
+        )
+        try:
+            for response in responses:
+                if response.status_code != HTTPStatus.OK:
+                    # raises on rate limit, otherwise reports the error
+                    self._handle_dashscope_response(response, messages)
+                    return
+                self._report_dashscope_usage(response.usage)
+                yield response.output.choices[0].message.content
+        finally:
+            responses.close()
+
+    async def astream_with_messages_online_for_dashscope(self, messages):
+        from dashscope import AioGeneration
+
+        responses = await AioGeneration.call(
+            model=self.model,
+            messages=messages,
+            api_key=self.api_key,
+            seed=random.randint(1, 10000),
+            **self.DASHSCOPE_SAMPLING_PARAMS,
+            result_format="message",
+            stream=True,
+            incremental_output=True,
+        )
+        try:
+            async for response in responses:
+                if response.status_code != HTTPStatus.OK:
+                    self._handle_dashscope_response(response, messages)
+                    return
+                self._report_dashscope_usage(response.usage)
+                yield response.output.choices[0].message.content
+        finally:
+            await responses.aclose()
+
+    def _report_openai_usage(self, usage):
+        if usage is not None:
+            _update_usage(
+                prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens
+            )
+
+    def _report_dashscope_usage(self, usage):
+        # cumulative in streaming mode, so the last response wins
+        if usage is not None:
+            _update_usage(prompt_tokens=usage.input_tokens, completion_tokens=usage.output_tokens)
+
+    def _handle_dashscope_response(self, response, messages):
         if response.status_code == HTTPStatus.OK:
-            content = response.output.choices[0].message.content
-            return content
-        else:
-            if response.code == 429:  # Requests rate limit exceeded
-                print(
-                    f"Request id: {response.request_id}, Status code: {response.status_code}"
-                    + f", error code: {response.code}, error message: {response.message}"
-                    + "too many request,ready to retry in 1 second "
-                )
-                time.sleep(1)
-                print(f"Request id: {response.request_id}, begin to retry")
-                return self.call_with_messages_online_for_dashscope(messages)
-            else:
-                print(
-                    f"Request id: {response.request_id}, Status code: {response.status_code}"
-                    + f", error code: {response.code}, error message: {response.message}"
-                )
-                print("Failed!", messages[1]["content"])
-                return ""
+            self._report_dashscope_usage(response.usage)
+            return response.output.choices[0].message.content
+        error_info = (
+            f"Request id: {response.request_id}, Status code: {response.status_code}"
+            + f", error code: {response.code}, error message: {response.message}"
+        )
+        # Requests rate limit exceeded
+        if response.status_code == HTTPStatus.TOO_MANY_REQUESTS or response.code == 429:
+            raise RateLimitExceeded(error_info)
+        print(error_info)
+        print("Failed!", messages[-1]["content"])
+        return ""
 
 
 if __name__ == "__main__":
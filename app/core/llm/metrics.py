@@ -0,0 +1,232 @@
+"""Per-call instrumentation of LlmClient.
+
+Every call produces an LlmCallRecord that is handed to a pluggable MetricsSink. The
+pipeline stage a call belongs to is taken from the ``llm_stage`` context, so callers
+can attribute tokens and latency to grading, translation, generation, etc.
+"""
+
+from abc import ABC, abstractmethod
+import asyncio
+from collections import defaultdict
+import contextvars
+from dataclasses import asdict, dataclass
+import functools
+import inspect
+import json
+import threading
+from typing import Dict, List, Optional
+
+_current_stage = contextvars.ContextVar("llm_stage", default="default")
+
+
+class llm_stage:
+    """Attribute every LLM call made inside a block (and its asyncio tasks) to a stage.
+
+    Works as a context manager or as a decorator of sync, async and generator functions:
+
+        with llm_stage("grading"):
+            ...
+
+        @llm_stage("translation")
+        def translate(...):
+            ...
+    """
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self._tokens = []
+
+    def __enter__(self):
+        self._tokens.append(_current_stage.set(self.stage))
+        return self
+
+    def __exit__(self, *exc_info):
+        _current_stage.reset(self._tokens.pop())
+
+    def __call__(self, func):
+        stage = self.stage
+        if asyncio.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with llm_stage(stage):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        if inspect.isgeneratorfunction(func):
+
+            @functools.wraps(func)
+            def generator_wrapper(*args, **kwargs):
+                # the stage is set around every resumption of the generator instead of
+                # leaking into the consumer between items
+                generator = func(*args, **kwargs)
+                resume, value = generator.send, None
+                while True:
+                    try:
+                        with llm_stage(stage):
+                            item = resume(value)
+                    except StopIteration as stop:
+                        return stop.value
+                    try:
+                        resume, value = generator.send, (yield item)
+                    except GeneratorExit:
+                        with llm_stage(stage):
+                            generator.close()
+                        raise
+                    except BaseException as e:
+                        resume, value = generator.throw, e
+
+            return generator_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with llm_stage(stage):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+
+def current_stage() -> str:
+    return _current_stage.get()
+
+
+@dataclass
+class LlmCallRecord:
+    stage: str
+    platform: str
+    model: str
+    prompt_tokens: int
+    completion_tokens: int
+    latency: float
+    retries: int
+    # "hit", "miss", "coalesced" (served by an identical in-flight call) or "disabled"
+    cache_status: str
+    success: bool
+    timestamp: float
+
+
+class MetricsSink(ABC):
+    """Destination of LlmCallRecords, must be safe to call from several threads."""
+
+    @abstractmethod
+    def record(self, record: LlmCallRecord) -> None:
+        """Consume one call record."""
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(q * len(sorted_values)))
+    return sorted_values[index]
+
+
+class InMemoryMetricsSink(MetricsSink):
+    """Aggregates call records per (stage, model) in memory."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[tuple, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        self._latencies: Dict[tuple, List[float]] = defaultdict(list)
+
+    def record(self, record: LlmCallRecord) -> None:
+        key = (record.stage, record.model)
+        with self._lock:
+            counters = self._counters[key]
+            counters["calls"] += 1
+            counters[f"cache_{record.cache_status}"] += 1
+            counters["errors"] += 0 if record.success else 1
+            counters["retries"] += record.retries
+            counters["prompt_tokens"] += record.prompt_tokens
+            counters["completion_tokens"] += record.completion_tokens
+            self._latencies[key].append(record.latency)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Return totals and latency percentiles keyed by "stage/model"."""
+        result = {}
+        with self._lock:
+            for key, counters in self._counters.items():
+                latencies = sorted(self._latencies[key])
+                result["/".join(key)] = {
+                    **counters,
+                    "latency_p50": _percentile(latencies, 0.5),
+                    "latency_p95": _percentile(latencies, 0.95),
+                    "latency_p99": _percentile(latencies, 0.99),
+                    "latency_total": sum(latencies),
+                }
+        return result
+
+
+class JsonlMetricsSink(MetricsSink):
+    """Appends every call record as one JSON line to a file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def record(self, record: LlmCallRecord) -> None:
+        line = json.dumps(asdict(record), ensure_ascii=False)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+class PrometheusMetricsSink(InMemoryMetricsSink):
+    """Aggregates records in memory and renders them in the Prometheus text format."""
+
+    def exposition(self) -> str:
+        lines = []
+        metrics = [
+            ("llm_calls_total", "calls", "Number of LLM calls."),
+            ("llm_errors_total", "errors", "Number of failed LLM calls."),
+            ("llm_retries_total", "retries", "Number of retried LLM requests."),
+            ("llm_prompt_tokens_total", "prompt_tokens", "Prompt tokens sent."),
+            ("llm_completion_tokens_total", "completion_tokens", "Completion tokens received."),
+        ]
+        with self._lock:
+            items = [(key, dict(counters)) for key, counters in self._counters.items()]
+            latencies = {key: sorted(values) for key, values in self._latencies.items()}
+        for name, field, help_text in metrics:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for (stage, model), counters in items:
+                labels = f'stage="{stage}",model="{model}"'
+                lines.append(f"{name}{{{labels}}} {counters.get(field, 0):g}")
+        lines.append("# HELP llm_latency_seconds Latency of LLM calls.")
+        lines.append("# TYPE llm_latency_seconds summary")
+        for (stage, model), values in latencies.items():
+            labels = f'stage="{stage}",model="{model}"'
+            for q in (0.5, 0.95, 0.99):
+                value = _percentile(values, q)
+                lines.append(f'llm_latency_seconds{{{labels},quantile="{q}"}} {value:g}')
+            lines.append(f"llm_latency_seconds_sum{{{labels}}} {sum(values):g}")
+            lines.append(f"llm_latency_seconds_count{{{labels}}} {len(values)}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str) -> None:
+        """Write the exposition to a file, e.g. for the node exporter textfile collector."""
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.exposition())
+
+
+class MultiMetricsSink(MetricsSink):
+    """Fans records out to several sinks."""
+
+    def __init__(self, sinks: List[MetricsSink]):
+        self.sinks = sinks
+
+    def record(self, record: LlmCallRecord) -> None:
+        for sink in self.sinks:
+            sink.record(record)
+
+
+@dataclass
+class CallUsage:
+    """Usage collected by the backends while a single call is in progress."""
+
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    retries: int = 0
+    cache_status: str = "disabled"
+    # platform and model that answered, set by pooled clients after failover
+    platform: Optional[str] = None
+    model: Optional[str] = None
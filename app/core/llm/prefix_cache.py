@@ -0,0 +1,99 @@
+"""Reuse of the key/value cache of repeated system prompts in local inference.
+
+Translators and generators send the same long system prompt with every call. Encoding
+it once and handing a copy of its past_key_values to ``generate`` leaves only the user
+turn to be prefilled, which is most of the time-to-first-token on CPU.
+"""
+
+from collections import OrderedDict
+import copy
+import threading
+from typing import Dict, List, Optional
+
+
+class PrefixKvCache:
+    """LRU cache of past_key_values for the system prompt prefix of chat messages.
+
+    Entries are keyed by the token ids of the rendered system turn, so they stay valid
+    for every request that starts with the same tokens regardless of the user turn.
+
+    Args:
+        model: Causal LM used for generation.
+        tokenizer: Tokenizer of the model, must provide a chat template.
+        device: Device the model runs on.
+        max_entries: Number of prefixes kept; the least recently used one is dropped.
+    """
+
+    def __init__(self, model, tokenizer, device, max_entries: int = 8):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.device = device
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[tuple, object]" = OrderedDict()
+
+    def _prefix_ids(self, messages: List[Dict[str, str]]) -> Optional[List[int]]:
+        if not messages or messages[0]["role"] != "system":
+            return None
+        return list(self.tokenizer.apply_chat_template(messages[:1], tokenize=True))
+
+    def _encode(self, prefix_ids: List[int]):
+        import torch
+
+        input_ids = torch.tensor([prefix_ids], device=self.device)
+        with torch.no_grad():
+            return self.model(input_ids=input_ids, use_cache=True).past_key_values
+
+    def warm(self, system_prompt: str) -> None:
+        """Precompute the prefix of a known system prompt."""
+        prefix_ids = self._prefix_ids([{"role": "system", "content": system_prompt}])
+        key = tuple(prefix_ids)
+        with self._lock:
+            if key in self._entries:
+                return
+        past_key_values = self._encode(prefix_ids)
+        with self._lock:
+            self._store(key, past_key_values)
+
+    def _store(self, key: tuple, past_key_values) -> None:
+        # caller holds self._lock
+        self._entries[key] = past_key_values
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def lookup(self, messages: List[Dict[str, str]], input_ids):
+        """Return past_key_values for the prefix of input_ids, or None if not applicable.
+
+        The returned cache is a copy, generate extends it in place.
+        """
+        prefix_ids = self._prefix_ids(messages)
+        if prefix_ids is None:
+            return None
+        prompt_ids = input_ids[0].tolist()
+        # the user turn must add at least one token and the template must render the
+        # system turn identically on its own
+        if len(prefix_ids) >= len(prompt_ids) or prompt_ids[: len(prefix_ids)] != prefix_ids:
+            return None
+        key = tuple(prefix_ids)
+        with self._lock:
+            past_key_values = self._entries.get(key)
+            if past_key_values is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        if past_key_values is None:
+            past_key_values = self._encode(prefix_ids)
+            with self._lock:
+                self.misses += 1
+                self._store(key, past_key_values)
+        return copy.deepcopy(past_key_values)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
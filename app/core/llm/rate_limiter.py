@@ -0,0 +1,175 @@
+"""Process-wide rate limiting for LLM calls.
+
+Each model gets a shared ModelRateLimiter combining request/token budgets (token
+buckets refilled per minute) with an AIMD concurrency controller: parallelism grows
+additively while calls succeed and is cut multiplicatively when the provider throttles.
+"""
+
+import asyncio
+import threading
+import time
+from typing import Dict, List, Optional
+
+
+class RateLimitExceeded(Exception):
+    """Raised by a backend call when the provider rejected it with a rate limit error."""
+
+
+def estimate_tokens(messages: List[Dict[str, str]]) -> int:
+    """Roughly estimate the token count of a message list (about 4 characters per token)."""
+    return sum(len(message.get("content") or "") for message in messages) // 4 + 1
+
+
+class TokenBucket:
+    """Thread-safe token bucket holding at most ``capacity`` units, refilled per minute."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self._available = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._available = min(self.capacity, self._available + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def try_consume(self, amount: float) -> float:
+        """Consume amount if available. Returns 0 on success, else the seconds to wait."""
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._available >= amount:
+                self._available -= amount
+                return 0.0
+            return (amount - self._available) / self.rate
+
+    def debit(self, amount: float) -> None:
+        """Consume amount unconditionally, e.g. for output tokens known only after a call."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._available -= amount
+
+    def consume(self, amount: float) -> None:
+        while True:
+            wait = self.try_consume(amount)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    async def aconsume(self, amount: float) -> None:
+        while True:
+            wait = self.try_consume(amount)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+
+class AimdConcurrencyController:
+    """Additive-increase/multiplicative-decrease limit on the number of in-flight calls.
+
+    Every successful call raises the limit by ``increase / limit`` (about +increase per
+    window of calls) and every throttled call multiplies it by ``decrease_factor``.
+    """
+
+    def __init__(
+        self,
+        initial: int = 4,
+        minimum: int = 1,
+        maximum: int = 64,
+        increase: float = 1.0,
+        decrease_factor: float = 0.5,
+    ):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.in_flight = 0
+        self._cond = threading.Condition()
+
+    def try_acquire(self) -> bool:
+        with self._cond:
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return True
+            return False
+
+    def acquire(self) -> None:
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    async def aacquire(self) -> None:
+        delay = 0.01
+        while not self.try_acquire():
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.2)
+
+    def release(self, throttled: bool = False) -> None:
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(self.minimum, self.limit * self.decrease_factor)
+            else:
+                self.limit = min(self.maximum, self.limit + self.increase / self.limit)
+            self._cond.notify_all()
+
+
+class ModelRateLimiter:
+    """Request/token budgets and adaptive concurrency shared by all calls to one model."""
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        initial_concurrency: int = 4,
+        max_concurrency: int = 64,
+    ):
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.concurrency = AimdConcurrencyController(
+            initial=initial_concurrency, maximum=max_concurrency
+        )
+
+    def acquire(self, estimated_tokens: int) -> None:
+        self.concurrency.acquire()
+        if self.request_bucket is not None:
+            self.request_bucket.consume(1)
+        if self.token_bucket is not None:
+            self.token_bucket.consume(estimated_tokens)
+
+    async def aacquire(self, estimated_tokens: int) -> None:
+        await self.concurrency.aacquire()
+        if self.request_bucket is not None:
+            await self.request_bucket.aconsume(1)
+        if self.token_bucket is not None:
+            await self.token_bucket.aconsume(estimated_tokens)
+
+    def release(self, throttled: bool = False, completion_tokens: int = 0) -> None:
+        if self.token_bucket is not None and completion_tokens:
+            self.token_bucket.debit(completion_tokens)
+        self.concurrency.release(throttled)
+
+
+_rate_limiters: Dict[str, ModelRateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def configure_rate_limit(model: str, **kwargs) -> ModelRateLimiter:
+    """Set the process-wide budgets for a model, see ModelRateLimiter for the options."""
+    with _rate_limiters_lock:
+        limiter = ModelRateLimiter(**kwargs)
+        _rate_limiters[model] = limiter
+        return limiter
+
+
+def get_rate_limiter(model: str) -> ModelRateLimiter:
+    """Return the process-wide limiter of a model, creating an unbudgeted one if needed."""
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(model)
+        if limiter is None:
+            limiter = ModelRateLimiter()
+            _rate_limiters[model] = limiter
+        return limiter
@@ -0,0 +1,89 @@
+"""Single-flight coalescing of identical in-flight calls.
+
+While a call for a key is outstanding, further calls with the same key wait for and
+share its result instead of issuing their own request.
+"""
+
+import asyncio
+from concurrent.futures import Future
+import threading
+from typing import Any, Awaitable, Callable, Dict
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key into one outstanding call.
+
+    Attributes:
+        calls: Number of calls that were actually executed.
+        coalesced: Number of calls that were served by another in-flight call.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._futures: Dict[str, Future] = {}
+        self._async_futures: Dict[tuple, asyncio.Future] = {}
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        """Run fn for key, or wait for the result of the call already running for key."""
+        with self._lock:
+            future = self._futures.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self._futures[key] = future
+                self.calls += 1
+            else:
+                self.coalesced += 1
+
+        if not is_leader:
+            return future.result()
+
+        try:
+            result = fn()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._futures.pop(key, None)
+
+    async def ado(self, key: str, coro_fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Asynchronous counterpart of do, coalescing calls within the running event loop."""
+        loop = asyncio.get_running_loop()
+        flight_key = (id(loop), key)
+        with self._lock:
+            future = self._async_futures.get(flight_key)
+            is_leader = future is None
+            if is_leader:
+                future = loop.create_future()
+                self._async_futures[flight_key] = future
+                self.calls += 1
+            else:
+                self.coalesced += 1
+
+        if not is_leader:
+            # shield so a cancelled follower does not cancel the shared call
+            return await asyncio.shield(future)
+
+        try:
+            result = await coro_fn()
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # mark the exception as retrieved in case no follower is waiting
+            future.exception()
+            raise
+        finally:
+            with self._lock:
+                self._async_futures.pop(flight_key, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {"calls": self.calls, "coalesced": self.coalesced}
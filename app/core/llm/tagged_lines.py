@@ -0,0 +1,30 @@
+"""Parsing helpers for the line based responses of the question prompts."""
+
+import re
+from typing import Iterable
+
+# "[3] question", optionally behind list markers, quotes or markdown emphasis
+TAGGED_LINE_PATTERN = re.compile(r"^[\s\-*\"'`]*\[(\d+)\]\s*(.*)$")
+
+# markup that models wrap around the questions of a response
+KEYWORDS_TO_REMOVE = [
+    "Cypher: ",
+    "   **Translation:**",
+    "**",
+    "    -",
+    "`",
+    ". ",
+]
+
+
+def clean_line(line: str, keywords_to_remove: Iterable[str] = KEYWORDS_TO_REMOVE) -> str:
+    # remove keywords
+    for keyword in keywords_to_remove:
+        if keyword == ". ":  # remove "1."
+            dot_index = line.find(". ")
+            if dot_index != -1:
+                line = line[dot_index + 2 :]
+                continue
+        line = line.replace(keyword, "")
+    # remove white space
+    return line.strip()
@@ -164,19 +164,20 @@ For example:
 
 """  # noqa: E501
 
-TRANSLATION_PROMPT_TEMPLATE = """
+BATCH_TRANSLATION_PROMPT_TEMPLATE = """
 Command
-Your task as a Cypher expert is to accurately translate the given natural language question into a Cypher query statement.
+Your task as a Cypher expert is to accurately translate each of the given natural language questions into a Cypher query statement.
 
 1. Graph Schema
-This is the Schema of the graph the query is based on:
+This is the Schema of the graph the queries are based on:
 ```JSON
 {schema_json}
 ```
 
-2. Question to be Translated
+2. Questions to be Translated
+Each question has an "id". Translate every question on its own, they are unrelated to each other.
 ```json
-{question}
+{questions_json}
 ```
 
 3. !!! Important Rules !!!
@@ -190,10 +191,16 @@ Rule 4: Use '%Y-%m-%d %H:%M:%S' format for time representation
 
 {error_context}
 
-3. Output Format
-Return in JSON object format containing only the "query" key. Do not add any additional explanations.
+4. Output Format
+Return a JSON list with exactly one object per question, each containing only the "id" of the question and the "query" key. Do not add any additional explanations.
 For example:
-{{
-"query": "MATCH (m:Movie) WHERE m.title = 'some movie' RETURN m"
-}}
+[
+{{"id": 1, "query": "MATCH (m:Movie) WHERE m.title = 'some movie' RETURN m"}},
+{{"id": 2, "query": "MATCH (p:Person)-[:ACTED_IN]->(m:Movie) RETURN p.name, count(m)"}}
+]
+"""  # noqa: E501
+
+BATCH_TRANSLATION_ERROR_TEMPLATE = """
+Previous attempts at some of these questions failed, avoid repeating these errors:
+{errors}
 """  # noqa: E501
@@ -0,0 +1,95 @@
+import threading
+from typing import Dict, List, Optional, Tuple
+
+
+class AdaptiveChunker:
+    """Packs items into chunks by token budget and adapts the chunk size to the outcome.
+
+    A chunk takes items until their tokens would exceed token_budget or the current
+    item limit is reached. The item limit shrinks when the moving rate of responses with
+    the wrong number of lines rises above shrink_above, and grows by one per clean
+    response while the rate stays below grow_below.
+
+    Args:
+        token_budget: Maximum tokens of the items in one chunk, the prompt excluded.
+        initial_items: Item limit to start from.
+        min_items: Lower bound of the item limit.
+        max_items: Upper bound of the item limit.
+        shrink_above: Mismatch rate above which a mismatch shrinks the item limit.
+        grow_below: Mismatch rate below which a clean response grows the item limit.
+        decrease_factor: Factor applied to the item limit when shrinking.
+        smoothing: Weight of the newest response in the moving mismatch rate.
+    """
+
+    def __init__(
+        self,
+        token_budget: int = 2000,
+        initial_items: int = 10,
+        min_items: int = 1,
+        max_items: int = 100,
+        shrink_above: float = 0.2,
+        grow_below: float = 0.05,
+        decrease_factor: float = 0.5,
+        smoothing: float = 0.2,
+    ):
+        self.token_budget = token_budget
+        self.items_limit = float(initial_items)
+        self.min_items = min_items
+        self.max_items = max_items
+        self.shrink_above = shrink_above
+        self.grow_below = grow_below
+        self.decrease_factor = decrease_factor
+        self.smoothing = smoothing
+        self.mismatch_rate = 0.0
+        self.chunks = 0
+        self.mismatches = 0
+        self._lock = threading.Lock()
+
+    def pack(
+        self, token_counts: List[int], max_chunks: Optional[int] = None
+    ) -> List[Tuple[int, int]]:
+        """Split items with the given token counts into (start, end) ranges.
+
+        Stops after max_chunks chunks, the remaining items are left for a later call so
+        they are packed with the item limit of that time.
+        """
+        with self._lock:
+            items_limit = max(self.min_items, int(self.items_limit))
+        ranges = []
+        start = 0
+        while start < len(token_counts) and (max_chunks is None or len(ranges) < max_chunks):
+            end = start + 1
+            tokens = token_counts[start]
+            while (
+                end < len(token_counts)
+                and end - start < items_limit
+                and tokens + token_counts[end] <= self.token_budget
+            ):
+                tokens += token_counts[end]
+                end += 1
+            ranges.append((start, end))
+            start = end
+        return ranges
+
+    def record(self, expected: int, received: int) -> None:
+        """Report how many lines a chunk of expected items came back with."""
+        mismatch = expected != received
+        with self._lock:
+            self.chunks += 1
+            self.mismatches += mismatch
+            self.mismatch_rate += self.smoothing * (mismatch - self.mismatch_rate)
+            if mismatch and self.mismatch_rate > self.shrink_above:
+                self.items_limit = max(self.min_items, self.items_limit * self.decrease_factor)
+                # start over from a neutral rate, so one more mismatch is needed to shrink again
+                self.mismatch_rate = (self.shrink_above + self.grow_below) / 2
+            elif not mismatch and self.mismatch_rate < self.grow_below:
+                self.items_limit = min(self.max_items, self.items_limit + 1)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "items_limit": int(self.items_limit),
+                "mismatch_rate": self.mismatch_rate,
+                "chunks": self.chunks,
+                "mismatches": self.mismatches,
+            }
@@ -1,4 +1,4 @@
-HIERARCHICAL_PROMPT_TEMPLATE = """You are an expert in Graph Query Language (GQL) and natural language understanding. Your task is to generate 3 levels of natural language descriptions for the given GQL query, following the framework from "Accessible Visualization via Natural Language Descriptions: A Four-Level Model of Semantic Content".
+HIERARCHICAL_FRAMEWORK = """You are an expert in Graph Query Language (GQL) and natural language understanding. Your task is to generate 3 levels of natural language descriptions for the given GQL query, following the framework from "Accessible Visualization via Natural Language Descriptions: A Four-Level Model of Semantic Content".
 
 ## 3-Level Framework Definition:
 
@@ -18,7 +18,18 @@ HIERARCHICAL_PROMPT_TEMPLATE = """You are an expert in Graph Query Language (GQL
 - Example: "Analyze company incorporation trends throughout the year 2026."
 
 ---
+"""
 
+HIERARCHICAL_GUIDELINES = """**Important Guidelines:**
+1. Each level should be a complete, standalone natural language question or statement.
+2. Level 1 should include explicit graph terminology (nodes, relationships, properties).
+3. Level 2 should be semantically clear without graph-specific terms.
+4. Level 3 should focus on analytical methodology or data exploration strategy.
+5. Ensure smooth progression from concrete (L1) to abstract (L3).
+6. Each level should be distinct from the others in abstraction and focus.
+"""
+
+HIERARCHICAL_PROMPT_TEMPLATE = HIERARCHICAL_FRAMEWORK + """
 ## Given Information:
 
 **Data Schema (optional):**
@@ -37,14 +48,7 @@ HIERARCHICAL_PROMPT_TEMPLATE = """You are an expert in Graph Query Language (GQL
 
 Based on the GQL query above, generate 3 levels of natural language descriptions.
 
-**Important Guidelines:**
-1. Each level should be a complete, standalone natural language question or statement.
-2. Level 1 should include explicit graph terminology (nodes, relationships, properties).
-3. Level 2 should be semantically clear without graph-specific terms.
-4. Level 3 should focus on analytical methodology or data exploration strategy.
-5. Ensure smooth progression from concrete (L1) to abstract (L3).
-6. Each level should be distinct from the others in abstraction and focus.
-
+""" + HIERARCHICAL_GUIDELINES + """
 **Output Format:**
 Please provide your response in the following JSON format:
 
@@ -57,6 +61,45 @@ Please provide your response in the following JSON format:
 }}
 ```"""
 
+HIERARCHICAL_BATCH_ITEM_TEMPLATE = """
+### Query {id}
+
+**Data Schema (optional):**
+```
+{data_schema}
+```
+
+**GQL Query:**
+```gql
+{gql_query}
+```
+"""
+
+HIERARCHICAL_BATCH_PROMPT_TEMPLATE = HIERARCHICAL_FRAMEWORK + """
+## Given Information:
+{query_items}
+---
+
+## Task:
+
+For each GQL query above, generate 3 levels of natural language descriptions.
+
+""" + HIERARCHICAL_GUIDELINES + """7. Describe every query on its own and keep its id.
+
+**Output Format:**
+Please provide your response as one JSON array with one object per query, in the following format:
+
+```json
+[
+  {{
+    "id": 1,
+    "level_1": "Your Level 1 description here",
+    "level_2": "Your Level 2 description here",
+    "level_3": "Your Level 3 description here"
+  }}
+]
+```"""
+
 EXTERNAL_KNOWLEDGE_PROMPT_TEMPLATE = """
 You are an expert in Graph Query Language (GQL) and natural language (NL) understanding. Your task is to generate the external knowledge for high level NL based on the gql query and basic NL query. The external knowledge should be specific and clear, and should be able to help the model understand the high level NL query better.
 
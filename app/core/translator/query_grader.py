@@ -11,7 +11,9 @@ import random
 import re
 from typing import Any, Dict, List
 
+from app.core.llm.cascade import CascadingLlmClient
 from app.core.llm.llm_client import LlmClient
+from app.core.llm.metrics import llm_stage
 from app.core.prompt.grade import (
     NL2GQL_BATCH_DIFFICULTY_PROMPT_TEMPLATE,
     NL2GQL_BATCH_DIFFICULTY_SYSTEM,
@@ -87,6 +89,31 @@ class QueryGrader:
         diff = item.get("difficulty")
         return isinstance(diff, str) and diff.lower() in self.VALID_DIFFICULTIES
 
+    def _find_difficulty(self, grade_res: Dict[str, Any]):
+        """Return the lower-cased difficulty of a graded item, or None if it has none."""
+        # Flexibly match various possible keys
+        for key in ["difficulty", "Difficulty", "grade"]:
+            if key in grade_res:
+                return str(grade_res[key]).lower()
+            # Compatible with nested format
+            if "grade_info" in grade_res and isinstance(grade_res["grade_info"], dict):
+                if key in grade_res["grade_info"]:
+                    return str(grade_res["grade_info"][key]).lower()
+        return None
+
+    def _grading_validator(self, ids):
+        """Accept responses that grade every id with a valid difficulty."""
+
+        def validate(messages, output):
+            graded = {
+                g.get("id"): self._find_difficulty(g)
+                for g in self._extract_json_list(output or "")
+                if isinstance(g, dict)
+            }
+            return all(graded.get(i) in self.VALID_DIFFICULTIES for i in ids)
+
+        return validate
+
     async def _process_batch(
         self,
         batch_items: List[Dict[str, Any]],
@@ -130,16 +157,24 @@ class QueryGrader:
         async with semaphore:
             for attempt in range(max_retries):
                 try:
-                    response = await asyncio.to_thread(self.llm_client.call_with_messages, messages)
+                    # a cascade escalates responses that leave items ungraded
+                    validator_kwargs = (
+                        {"validator": self._grading_validator(list(item_map))}
+                        if isinstance(self.llm_client, CascadingLlmClient)
+                        else {}
+                    )
+                    response = await self.llm_client.acall_with_messages_until_json(
+                        messages, expect_list=True, **validator_kwargs
+                    )
 
                     if not response:
                         # Fixed: Use more specific exceptions instead of generic Exception
                         raise ValueError("Empty response from LLM")
-                    if "429" in str(response) or "Rate limit" in str(response):
-                        raise ConnectionError("Rate limit hit")
 
                     graded_results = self._extract_json_list(response)
                     if not graded_results:
+                        # the retry sends the same messages, which must not hit the cache
+                        await asyncio.to_thread(self.llm_client.invalidate, messages)
                         raise ValueError("Failed to parse JSON list from LLM response")
 
                     # 3. Backfill results
@@ -148,21 +183,7 @@ class QueryGrader:
 
                     for temp_id, original_item in item_map.items():
                         grade_res = result_lookup.get(temp_id)
-                        found_diff = None
-
-                        if grade_res:
-                            # Flexibly match various possible keys
-                            for key in ["difficulty", "Difficulty", "grade"]:
-                                if key in grade_res:
-                                    found_diff = str(grade_res[key]).lower()
-                                    break
-                                # Compatible with nested format
-                                if "grade_info" in grade_res and isinstance(
-                                    grade_res["grade_info"], dict
-                                ):
-                                    if key in grade_res["grade_info"]:
-                                        found_diff = str(grade_res["grade_info"][key]).lower()
-                                        break
+                        found_diff = self._find_difficulty(grade_res) if grade_res else None
 
                         if found_diff in self.VALID_DIFFICULTIES:
                             original_item["difficulty"] = found_diff
@@ -180,9 +201,9 @@ class QueryGrader:
 
                 except Exception as e:
                     # Capturing general exceptions here is fine for retries, 
-                    # but we log the specific error
-                    is_rate_limit = "429" in str(e) or "Rate limit" in str(e)
-                    sleep_time = (2**attempt) + random.uniform(1, 3) + (10 if is_rate_limit else 0)
+                    # but we log the specific error. Rate limits are already retried with
+                    # adaptive backoff inside LlmClient, so only parse failures end up here.
+                    sleep_time = (2**attempt) + random.uniform(1, 3)
 
                     if attempt < max_retries - 1:
                         logger.warning(
@@ -197,6 +218,7 @@ class QueryGrader:
                             if "difficulty" not in item:
                                 item["difficulty"] = "error"
 
+    @llm_stage("grading")
     async def grade_query(
         self,
         query: List[Dict[str, Any]],
@@ -1,11 +1,28 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import contextvars
+import functools
+import itertools
 import json
-from typing import List, Optional, Tuple
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
 from tqdm import tqdm
 
+from app.core.llm.cascade import CascadingLlmClient, tagged_line_validator
+from app.core.llm.json_stream import JsonStreamExtractor
 from app.core.llm.llm_client import LlmClient
+from app.core.llm.metrics import llm_stage
+from app.core.llm.tagged_lines import KEYWORDS_TO_REMOVE, TAGGED_LINE_PATTERN, clean_line
+from app.core.translator.adaptive_chunker import AdaptiveChunker
 
-from app.core.translator.prompts import HIERARCHICAL_PROMPT_TEMPLATE, EXTERNAL_KNOWLEDGE_PROMPT_TEMPLATE
+from app.core.translator.prompts import (
+    EXTERNAL_KNOWLEDGE_PROMPT_TEMPLATE,
+    HIERARCHICAL_BATCH_ITEM_TEMPLATE,
+    HIERARCHICAL_BATCH_PROMPT_TEMPLATE,
+    HIERARCHICAL_PROMPT_TEMPLATE,
+)
+
+JSON_RETRY_PROMPT = "Your response is not valid JSON. Reply with the JSON object only."
 
 CONTENT_TEMPLATE = """
 Original Query: {query_template}
@@ -30,14 +47,14 @@ Original Query: MATCH (m:keyword{name: 'news report'})<-[:has_keyword]-(a:movie)
 Translated Question: "What movies have the keyword 'news report'? Return the corresponding nodes."
 
 Queries to translate:
-MATCH (m:movie{title: 'The Dark Knight'})<-[:write]-(a:person) RETURN a,m
-MATCH (m:user{login: 'Sherman'})<-[:is_friend]-(a:user) RETURN a,m
+[1] MATCH (m:movie{title: 'The Dark Knight'})<-[:write]-(a:person) RETURN a,m
+[2] MATCH (m:user{login: 'Sherman'})<-[:is_friend]-(a:user) RETURN a,m
 
 You should respond with:
-"Who are the authors of the movie 'The Dark Knight'? Return the relevant nodes.
-"Find the friend nodes of the logged-in user Sherman in the graph, returning the relevant node information."
+[1] "Who are the authors of the movie 'The Dark Knight'? Return the relevant nodes.
+[2] "Find the friend nodes of the logged-in user Sherman in the graph, returning the relevant node information."
 
-Now, translate each of the following queries one by one. Do not indicate which query you're translating from.
+Now, translate each of the following queries one by one. Start each result with the index of its query, such as [1], and do not skip or merge queries.
 Separate results with newline characters and ensure sentences include proper punctuation marks.
 """  # noqa: E501
 
@@ -65,52 +82,56 @@ Source Language: English
 Target Language: Chinese
 
 Questions to translate:
-[Original Question]:"What movies have the keyword 'news report'? Return the corresponding nodes." [Corresponding Query]:MATCH (m:keyword{name: 'news report'})<-[:has_keyword]-(a:movie) RETURN a,m
-[Original Question]:"Who are the authors of the movie 'The Dark Knight'? Return the relevant nodes." [Corresponding Query]:MATCH (m:movie{title: 'The Dark Knight'})<-[:write]-(a:person) RETURN a,m
-[Original Question]:"Find the friend nodes of the logged-in user Sherman in the graph, returning the relevant node information." [Corresponding Query]:MATCH (m:user{login: 'Sherman'})<-[:is_friend]-(a:user) RETURN a,m
+[1] [Original Question]:"What movies have the keyword 'news report'? Return the corresponding nodes." [Corresponding Query]:MATCH (m:keyword{name: 'news report'})<-[:has_keyword]-(a:movie) RETURN a,m
+[2] [Original Question]:"Who are the authors of the movie 'The Dark Knight'? Return the relevant nodes." [Corresponding Query]:MATCH (m:movie{title: 'The Dark Knight'})<-[:write]-(a:person) RETURN a,m
+[3] [Original Question]:"Find the friend nodes of the logged-in user Sherman in the graph, returning the relevant node information." [Corresponding Query]:MATCH (m:user{login: 'Sherman'})<-[:is_friend]-(a:user) RETURN a,m
 
 You should respond with:
-"哪些电影包含关键词“news report”？返回相应的节点。"
-"电影《The Dark Knight》的作者是谁？返回相关节点。"
-"在图中查找登录用户Sherman的好友节点，返回相关节点信息。"
+[1] "哪些电影包含关键词“news report”？返回相应的节点。"
+[2] "电影《The Dark Knight》的作者是谁？返回相关节点。"
+[3] "在图中查找登录用户Sherman的好友节点，返回相关节点信息。"
 
-Now, translate each of the following questions one by one. Do not indicate which question you're translating from.
+Now, translate each of the following questions one by one. Start each result with the index of its question, such as [1], and do not skip or merge questions.
 Separate results with newline characters and ensure sentences include proper punctuation marks.
 """  # noqa: E501
 
 
 class QuestionTranslator:
-    def __init__(self, llm_client: LlmClient, chunk_size):
+    def __init__(
+        self,
+        llm_client: LlmClient,
+        chunk_size,
+        batch_size=1,
+        use_batch_job=False,
+        max_concurrency=1,
+        chunker: Optional[AdaptiveChunker] = None,
+        repair_rounds=1,
+    ):
         self.llm_client = llm_client
         self.chunk_size = chunk_size
-        self.keywords_to_remove = [
-            "Cypher: ",
-            "   **Translation:**",
-            "**",
-            "    -",
-            "`",
-            ". ",
-        ]
-
+        # number of chunks submitted to the LLM client in one batched call
+        self.batch_size = batch_size
+        # number of batched calls in flight at the same time
+        self.max_concurrency = max_concurrency
+        # packs chunks by token budget instead of chunk_size when set
+        self.chunker = chunker
+        # follow-up requests for the items missing from a response
+        self.repair_rounds = repair_rounds
+        # submit all chunks of a call as one offline provider batch job instead
+        self.use_batch_job = use_batch_job
+        self.keywords_to_remove = list(KEYWORDS_TO_REMOVE)
+
+    @llm_stage("question_translation")
     def translate(
         self, query_template: str, question_template: str, query_list: List[str]
     ) -> List[Tuple[str, str]]:
-        question_list = []
-        chunk_size = self.chunk_size
-        query_chunk_list = [
-            query_list[i : i + chunk_size] for i in range(0, len(query_list), chunk_size)
-        ]
-        for query_chunk in query_chunk_list:
-            query_chunk_str = ""
-            for query in query_chunk:
-                query_chunk_str += query + "\n"
+        def build_messages(query_chunk_str):
             content = CONTENT_TEMPLATE.format(
                 query_template=query_template,
                 question_template=question_template,
                 query_chunk_str=query_chunk_str,
             )
-
-            messages = [
+            return [
                 {
                     "role": "system",
                     "content": PROMPT,
@@ -118,33 +139,11 @@ class QuestionTranslator:
                 {"role": "user", "content": content},
             ]
 
-            # 3. get response
-            response = self.llm_client.call_with_messages(messages)
-
-            # 4. postprocess and save
-            if response != "":
-                translated_question_list = self.post_process(response)
-
-                # deal with unexpected questions length
-                chunk_size = len(query_chunk)
-                questions_size = len(translated_question_list)
-
-                if questions_size > chunk_size:
-                    translated_question_list = translated_question_list[0:chunk_size]
-                elif questions_size < chunk_size:
-                    filled_questions = ["Question translation failed."] * (
-                        chunk_size - questions_size
-                    )
-                    translated_question_list = translated_question_list + filled_questions
-                else:
-                    pass
-            else:
-                translated_question_list = ["Question translation failed."] * (chunk_size)
-
-            question_list += translated_question_list
-
-        return question_list
+        return self.translate_chunks(
+            [query + "\n" for query in query_list], build_messages, "question_translation"
+        )
 
+    @llm_stage("multilingual_translation")
     def translate_multilingual(
         self,
         source_language: str,
@@ -152,78 +151,264 @@ class QuestionTranslator:
         question_list: List[str],
         query_list: List[str],
     ) -> List[Tuple[str, str]]:
-        target_language_question_list = []
-        corpus_pair_list = [(question_list[i], query_list[i]) for i in range(len(question_list))]
-        chunk_size = self.chunk_size
-        corpus_pair_chunk_list = [
-            corpus_pair_list[i : i + chunk_size]
-            for i in range(0, len(corpus_pair_list), chunk_size)
+        corpus_pair_lines = [
+            self.corpus_pair_line(question, query)
+            for question, query in zip(question_list, query_list)
         ]
-        for i in tqdm(
-            range(len(corpus_pair_chunk_list)),
+        return self.translate_chunks(
+            corpus_pair_lines,
+            functools.partial(
+                self.build_multilingual_messages, source_language, target_language
+            ),
+            f"translation_{source_language}_{target_language}",
             desc=f"Translating {source_language} into {target_language}",
-        ):
-            corpus_pair_chunk = corpus_pair_chunk_list[i]
-            corpus_pair_chunk_str = ""
-            for corpus_pair in corpus_pair_chunk:
-                corpus_pair_chunk_str += (
-                    f"[Original Question]:{corpus_pair[0]} [Corresponding Query]:{corpus_pair[1]}\n"
+        )
+
+    @llm_stage("multilingual_translation")
+    def iter_translate(
+        self,
+        pairs_iterable: Iterable[Tuple[str, str]],
+        source_language: str,
+        target_language: str,
+        start_offset: int = 0,
+        max_chunks_in_flight: Optional[int] = None,
+    ) -> Iterator[Tuple[int, str, str, str]]:
+        """Translate (question, query) pairs from an iterator of any length.
+
+        Chunks are read lazily and at most max_chunks_in_flight of them (twice
+        max_concurrency by default) are translated or waiting at any time. Items are
+        yielded in input order as soon as their chunk and all earlier ones completed.
+
+        Args:
+            pairs_iterable: (question, query) pairs, e.g. read from JSONL or parquet.
+            source_language: Language of the questions.
+            target_language: Language to translate into.
+            start_offset: Number of leading pairs to skip, to resume from a checkpoint.
+            max_chunks_in_flight: Bound of the chunks held in memory.
+        Yields:
+            (offset, question, query, translated_question). Once an offset was written
+            out, offset + 1 is a valid start_offset for resuming.
+        """
+        if self.use_batch_job:
+            raise ValueError("iter_translate does not support use_batch_job")
+        max_concurrency = max(1, self.max_concurrency)
+        max_chunks_in_flight = max_chunks_in_flight or 2 * max_concurrency
+        build_messages = functools.partial(
+            self.build_multilingual_messages, source_language, target_language
+        )
+        pairs = itertools.islice(iter(pairs_iterable), start_offset, None)
+        buffer: List[Tuple[str, str]] = []
+        in_flight = deque()
+        offset = start_offset
+        with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+            while True:
+                while len(in_flight) < max_chunks_in_flight:
+                    chunk = self._next_chunk(pairs, buffer)
+                    if not chunk:
+                        break
+                    item_lines = [self.corpus_pair_line(*pair) for pair in chunk]
+                    # worker threads keep the llm_stage of the caller
+                    future = executor.submit(
+                        contextvars.copy_context().run,
+                        self._translate_ranges,
+                        item_lines,
+                        [(0, len(item_lines))],
+                        build_messages,
+                        "",
+                    )
+                    in_flight.append((chunk, future))
+                if not in_flight:
+                    return
+                chunk, future = in_flight.popleft()
+                for (question, query), translated_question in zip(chunk, future.result()):
+                    yield offset, question, query, translated_question
+                    offset += 1
+
+    def _next_chunk(self, pairs: Iterator[Tuple[str, str]], buffer: List[Tuple[str, str]]):
+        """Take the next chunk from the look-ahead buffer, refilled from pairs."""
+        lookahead = self.chunk_size if self.chunker is None else self.chunker.max_items
+        buffer.extend(itertools.islice(pairs, max(0, lookahead - len(buffer))))
+        if self.chunker is None:
+            size = min(self.chunk_size, len(buffer))
+        elif buffer:
+            token_counts = [
+                self.llm_client.count_tokens(self.corpus_pair_line(*pair)) for pair in buffer
+            ]
+            size = self.chunker.pack(token_counts, max_chunks=1)[0][1]
+        else:
+            size = 0
+        chunk = buffer[:size]
+        del buffer[:size]
+        return chunk
+
+    @staticmethod
+    def corpus_pair_line(question: str, query: str) -> str:
+        return f"[Original Question]:{question} [Corresponding Query]:{query}\n"
+
+    @staticmethod
+    def build_multilingual_messages(source_language, target_language, corpus_pair_chunk_str):
+        content = CONTENT_TEMPLATE_MULTILINGUAL.format(
+            source_language=source_language,
+            target_language=target_language,
+            corpus_pair_chunk_str=corpus_pair_chunk_str,
+        )
+        return [
+            {
+                "role": "system",
+                "content": PROMPT_MULTILINGUAL,
+            },
+            {"role": "user", "content": content},
+        ]
+
+    def translate_chunks(self, item_lines, build_messages, job_name, desc=None):
+        """Translate items chunk by chunk and return one question per item.
+
+        Args:
+            item_lines: One prompt line per item.
+            build_messages: Builds the messages of a chunk from its joined item lines.
+            job_name: Name of the batch job when use_batch_job is set.
+            desc: Progress bar description, no bar if None.
+        """
+        if self.chunker is None:
+            ranges = [
+                (i, min(i + self.chunk_size, len(item_lines)))
+                for i in range(0, len(item_lines), self.chunk_size)
+            ]
+            return self._translate_ranges(item_lines, ranges, build_messages, job_name, desc)
+
+        # chunks are packed wave by wave, so every wave uses the latest item limit
+        token_counts = [self.llm_client.count_tokens(line) for line in item_lines]
+        wave_size = None if self.use_batch_job else max(1, self.max_concurrency) * self.batch_size
+        question_list = []
+        start = 0
+        with tqdm(total=len(item_lines), desc=desc, disable=desc is None) as progress:
+            while start < len(item_lines):
+                ranges = [
+                    (start + chunk_start, start + chunk_end)
+                    for chunk_start, chunk_end in self.chunker.pack(
+                        token_counts[start:], max_chunks=wave_size
+                    )
+                ]
+                question_list += self._translate_ranges(
+                    item_lines, ranges, build_messages, job_name
                 )
-            content = CONTENT_TEMPLATE_MULTILINGUAL.format(
-                source_language=source_language,
-                target_language=target_language,
-                corpus_pair_chunk_str=corpus_pair_chunk_str,
-            )
+                progress.update(ranges[-1][1] - start)
+                start = ranges[-1][1]
+        return question_list
 
-            messages = [
-                {
-                    "role": "system",
-                    "content": PROMPT_MULTILINGUAL,
-                },
-                {"role": "user", "content": content},
+    def _translate_ranges(self, item_lines, ranges, build_messages, job_name, desc=None):
+        # every item is tagged with its index in the chunk, so a response missing lines
+        # only loses those items and they are requested again in a smaller follow-up
+        translations: Dict[int, str] = {}
+        chunks = [list(range(start, end)) for start, end in ranges]
+        for repair_round in range(self.repair_rounds + 1):
+            if not chunks:
+                break
+            messages_list = [
+                build_messages(self.tag_lines([item_lines[i] for i in chunk])) for chunk in chunks
             ]
 
             # 3. get response
-            response = self.llm_client.call_with_messages(messages)
+            if self.use_batch_job:
+                response_list = self.llm_client.call_with_messages_batch_job(
+                    messages_list,
+                    job_name=job_name if repair_round == 0 else f"{job_name}_repair{repair_round}",
+                    **self._validator_kwargs(),
+                )
+            else:
+                response_list = self.dispatch(
+                    messages_list, desc=desc if repair_round == 0 else None
+                )
 
             # 4. postprocess and save
-            if response != "":
-                translated_question_list = self.post_process(response)
-
-                # deal with unexpected corpus pair list length
-                chunk_size = len(corpus_pair_chunk)
-                questions_size = len(translated_question_list)
-
-                if questions_size > chunk_size:
-                    translated_question_list = translated_question_list[0:chunk_size]
-                elif questions_size < chunk_size:
-                    filled_questions = ["Question translation failed."] * (
-                        chunk_size - questions_size
-                    )
-                    translated_question_list = translated_question_list + filled_questions
-                else:
-                    pass
-            else:
-                translated_question_list = ["Question translation failed."] * (chunk_size)
+            for chunk, response in zip(chunks, response_list):
+                chunk_translations = self.parse_tagged_response(response or "", len(chunk))
+                if self.chunker is not None and repair_round == 0:
+                    self.chunker.record(len(chunk), len(chunk_translations))
+                for index, translation in chunk_translations.items():
+                    translations[chunk[index - 1]] = translation
+
+            missing = [i for chunk in chunks for i in chunk if i not in translations]
+            chunks = [
+                missing[i : i + self.chunk_size] for i in range(0, len(missing), self.chunk_size)
+            ]
 
-            target_language_question_list += translated_question_list
+        return [
+            translations.get(i, "Question translation failed.")
+            for start, end in ranges
+            for i in range(start, end)
+        ]
 
-        return target_language_question_list
+    @staticmethod
+    def tag_lines(lines: List[str]) -> str:
+        return "".join(f"[{index}] {line}" for index, line in enumerate(lines, 1))
+
+    def parse_tagged_response(self, response: str, chunk_size: int) -> Dict[int, str]:
+        """Map the 1-based item index to its translation, leaving out missing items.
+
+        Responses without any index tag are accepted only if the line count matches.
+        """
+        translations = {}
+        untagged = []
+        for line in response.split("\n"):
+            match = TAGGED_LINE_PATTERN.match(line)
+            if match is None:
+                untagged.append(line)
+                continue
+            index = int(match.group(1))
+            translation = clean_line(match.group(2), self.keywords_to_remove)
+            if 1 <= index <= chunk_size and translation and index not in translations:
+                translations[index] = translation
+        if not translations:
+            question_list = self.post_process("\n".join(untagged))
+            if len(question_list) == chunk_size:
+                return dict(enumerate(question_list, 1))
+        return translations
+
+    def dispatch(self, messages_list, desc=None):
+        """Call the LLM for every chunk, up to max_concurrency batches at a time.
+
+        Responses are returned in the order of messages_list. With desc set, a progress
+        bar advances as batches complete.
+        """
+        batches = [
+            (i, messages_list[i : i + self.batch_size])
+            for i in range(0, len(messages_list), self.batch_size)
+        ]
+        response_list = [None] * len(messages_list)
+        with (
+            ThreadPoolExecutor(max_workers=max(1, self.max_concurrency)) as executor,
+            tqdm(total=len(messages_list), desc=desc, disable=desc is None) as progress,
+        ):
+            # worker threads keep the llm_stage of the caller
+            futures = {
+                executor.submit(
+                    contextvars.copy_context().run,
+                    self.llm_client.call_with_messages_batch,
+                    batch,
+                    batch_size=self.batch_size,
+                    **self._validator_kwargs(),
+                ): start
+                for start, batch in batches
+            }
+            for future in as_completed(futures):
+                start = futures[future]
+                responses = future.result()
+                response_list[start : start + len(responses)] = responses
+                progress.update(len(responses))
+        return response_list
+
+    def _validator_kwargs(self):
+        # a cascade escalates the chunks whose response misses some of the items
+        if isinstance(self.llm_client, CascadingLlmClient):
+            return {"validator": tagged_line_validator()}
+        return {}
 
     def post_process(self, response):
         lines = response.split("\n")
         translated_question_list = []
         for line in lines:
-            # remove keywords
-            for keyword in self.keywords_to_remove:
-                if keyword == ". ":  # remove "1."
-                    dot_index = line.find(". ")
-                    if dot_index != -1:
-                        line = line[dot_index + 2 :]
-                        continue
-                line = line.replace(keyword, "")
-            # remove white space
-            line = line.strip()
+            line = clean_line(line, self.keywords_to_remove)
             if line:
                 translated_question_list.append(line)
         return translated_question_list
@@ -239,14 +424,28 @@ class HierarchicalQuestionTranslator:
     sample_list = question_translator.translate_hierachical_questions(query_list)
     '''
 
-    def __init__(self, llm_client: LlmClient, need_external_knowledge: bool = True):
+    def __init__(
+        self,
+        llm_client: LlmClient,
+        need_external_knowledge: bool = True,
+        max_concurrency: int = 8,
+        max_json_retries: int = 2,
+        queries_per_prompt: int = 1,
+    ):
         '''
         Initialize the HierarchicalQuestionTranslator.
         Args:
             llm_client: LlmClient
             need_external_knowledge: bool = True
+            max_concurrency: int = 8, number of LLM calls in flight, shared by both stages
+            max_json_retries: int = 2, extra calls for a response that is not valid JSON
+            queries_per_prompt: int = 1, queries sharing one hierarchical prompt, queries
+                missing from a shared response fall back to a prompt of their own
         '''
         self.llm_client = llm_client
+        self.max_concurrency = max_concurrency
+        self.max_json_retries = max_json_retries
+        self.queries_per_prompt = queries_per_prompt
         self.hierarchical_prompt_template = HIERARCHICAL_PROMPT_TEMPLATE
         if need_external_knowledge:
             self.need_external_knowledge = True
@@ -255,6 +454,7 @@ class HierarchicalQuestionTranslator:
             self.need_external_knowledge = False
             self.external_knowledge_prompt_template = None
 
+    @llm_stage("hierarchical_translation")
     def translate_hierachical_questions(
         self, query_list: List[str], data_schema_list: Optional[List[str]] = None
     ) -> List[dict]:
@@ -288,30 +488,128 @@ class HierarchicalQuestionTranslator:
         elif len(data_schema_list) != len(query_list):
             raise ValueError("data_schema_list length must match query_list length")
 
-        # 1. generate prompt list
-        prompt_list = [
-            self.hierarchical_prompt_template.format(
-                gql_query=query, data_schema=data_schema
-            )
-            for query, data_schema in zip(query_list, data_schema_list)
-        ]
-        # 2. call LLM with prompt list
-        response_list = [
-            self.llm_client.call_with_messages([{"role": "user", "content": prompt}])
-            for prompt in prompt_list
-        ]
-        # 3. postprocess
-        hierarchical_question_list = [
-            self.post_process_hierarchical_questions_response(response, query)
-            for response, query in zip(response_list, query_list)
-        ]
+        if self.queries_per_prompt > 1:
+            return self.translate_query_groups(query_list, data_schema_list)
+
+        # every query runs its hierarchical call and, right after it, its external
+        # knowledge call on one bounded pool, so both stages overlap across queries
+        with ThreadPoolExecutor(max_workers=max(1, self.max_concurrency)) as executor:
+            futures = [
+                executor.submit(
+                    contextvars.copy_context().run, self.translate_query, query, data_schema
+                )
+                for query, data_schema in zip(query_list, data_schema_list)
+            ]
+            return [future.result() for future in futures]
 
-        # 4. translate external knowledge
+    def translate_query_groups(
+        self, query_list: List[str], data_schema_list: List[str]
+    ) -> List[dict]:
+        '''
+        Translate queries queries_per_prompt at a time, external knowledge is requested per
+        query as soon as its group is done.
+        Args:
+            query_list: List[str]
+            data_schema_list: List[str]
+        Returns:
+            List[dict]
+        '''
+        group_size = self.queries_per_prompt
+        sample_list = [None] * len(query_list)
+        with ThreadPoolExecutor(max_workers=max(1, self.max_concurrency)) as executor:
+            group_futures = {
+                executor.submit(
+                    contextvars.copy_context().run,
+                    self.translate_query_group,
+                    query_list[start : start + group_size],
+                    data_schema_list[start : start + group_size],
+                ): start
+                for start in range(0, len(query_list), group_size)
+            }
+            external_knowledge_futures = {}
+            for group_future in as_completed(group_futures):
+                start = group_futures[group_future]
+                for offset, hierarchical_question in enumerate(group_future.result()):
+                    if self.need_external_knowledge and hierarchical_question["level_3"]:
+                        future = executor.submit(
+                            contextvars.copy_context().run,
+                            self.add_external_knowledge_to_question,
+                            hierarchical_question,
+                        )
+                        external_knowledge_futures[future] = start + offset
+                    else:
+                        if self.need_external_knowledge:
+                            hierarchical_question["external_knowledge"] = ""
+                        sample_list[start + offset] = hierarchical_question
+            for future, index in external_knowledge_futures.items():
+                sample_list[index] = future.result()
+        return sample_list
+
+    def translate_query_group(
+        self, query_list: List[str], data_schema_list: List[str]
+    ) -> List[dict]:
+        '''
+        Generate the hierarchical questions of several queries with one prompt.
+        Args:
+            query_list: List[str]
+            data_schema_list: List[str]
+        Returns:
+            List[dict], without external knowledge
+        '''
+        query_items = "".join(
+            HIERARCHICAL_BATCH_ITEM_TEMPLATE.format(
+                id=index, data_schema=data_schema, gql_query=query
+            )
+            for index, (query, data_schema) in enumerate(zip(query_list, data_schema_list), 1)
+        )
+        prompt = HIERARCHICAL_BATCH_PROMPT_TEMPLATE.format(query_items=query_items)
+        response = self.llm_client.call_with_messages_until_json(
+            [{"role": "user", "content": prompt}], expect_list=True
+        )
+        results = self.post_process_hierarchical_batch_response(response, query_list)
+
+        hierarchical_question_list = []
+        for index, (query, data_schema) in enumerate(zip(query_list, data_schema_list), 1):
+            hierarchical_question = results.get(index)
+            if hierarchical_question is None:
+                # missing or incomplete in the shared response, ask for this query alone
+                hierarchical_question = self.generate_hierarchical_question(query, data_schema)
+            hierarchical_question_list.append(hierarchical_question)
+        return hierarchical_question_list
+
+    def translate_query(self, query: str, data_schema: str = "") -> dict:
+        '''
+        Translate one GQL query into hierarchical questions, with external knowledge if needed.
+        Args:
+            query: str
+            data_schema: str = ""
+        Returns:
+            dict
+        '''
+        hierarchical_question = self.generate_hierarchical_question(query, data_schema)
         if not self.need_external_knowledge:
-            return hierarchical_question_list
-        else:
-            hierarchical_question_list_with_external_knowledge = self.add_external_knowledge(hierarchical_question_list)
-            return hierarchical_question_list_with_external_knowledge
+            return hierarchical_question
+        if not hierarchical_question["level_3"]:
+            return {**hierarchical_question, "external_knowledge": ""}
+        return self.add_external_knowledge_to_question(hierarchical_question)
+
+    def generate_hierarchical_question(self, query: str, data_schema: str = "") -> dict:
+        '''
+        Generate the hierarchical questions of one query, with empty levels if it fails.
+        Args:
+            query: str
+            data_schema: str = ""
+        Returns:
+            dict
+        '''
+        prompt = self.hierarchical_prompt_template.format(gql_query=query, data_schema=data_schema)
+        hierarchical_question = self.call_with_json_retry(
+            prompt,
+            lambda response: self.post_process_hierarchical_questions_response(response, query),
+        )
+        if hierarchical_question is None:
+            return {"gql_query": query, "level_1": "", "level_2": "", "level_3": ""}
+        return hierarchical_question
 
     def add_external_knowledge(self, hierarchical_question_list: List[dict]) -> List[dict]:
         '''
@@ -329,35 +627,64 @@ class HierarchicalQuestionTranslator:
                 "external_knowledge": "The graph has 100 nodes."
             }
         '''
-        query_list = [item["gql_query"] for item in hierarchical_question_list]
-
-        # 1. generate prompt list
-        prompt_list = [
-            self.external_knowledge_prompt_template.format(
-                gql_query=query,
-                level_2=hierarchical_question["level_2"],
-                level_3=hierarchical_question["level_3"],
-            )
-            for query, hierarchical_question in zip(query_list, hierarchical_question_list)
-        ]
-
-        # 2. call LLM with prompt list
-        response_list = [
-            self.llm_client.call_with_messages([{"role": "user", "content": prompt}])
-            for prompt in prompt_list
-        ]
+        with ThreadPoolExecutor(max_workers=max(1, self.max_concurrency)) as executor:
+            futures = [
+                executor.submit(
+                    contextvars.copy_context().run,
+                    self.add_external_knowledge_to_question,
+                    hierarchical_question,
+                )
+                for hierarchical_question in hierarchical_question_list
+            ]
+            return [future.result() for future in futures]
 
-        # 3. postprocess
-        postprocessed_list = [
-            self.post_process_external_knowledge_response(
+    def add_external_knowledge_to_question(self, hierarchical_question: dict) -> dict:
+        '''
+        Add external knowledge to one hierarchical question sample, left empty if it fails.
+        Args:
+            hierarchical_question: dict
+        Returns:
+            dict
+        '''
+        query = hierarchical_question["gql_query"]
+        prompt = self.external_knowledge_prompt_template.format(
+            gql_query=query,
+            level_2=hierarchical_question["level_2"],
+            level_3=hierarchical_question["level_3"],
+        )
+        result = self.call_with_json_retry(
+            prompt,
+            lambda response: self.post_process_external_knowledge_response(
                 response, query, hierarchical_question
-            )
-            for response, query, hierarchical_question in zip(
-                response_list, query_list, hierarchical_question_list
-            )
-        ]
+            ),
+        )
+        if result is None:
+            return {**hierarchical_question, "external_knowledge": ""}
+        return result
 
-        return postprocessed_list
+    def call_with_json_retry(self, prompt: str, parse):
+        '''
+        Call the LLM with a prompt and parse the JSON response, asking again when it is invalid.
+        Args:
+            prompt: str
+            parse: parses a response, raising on invalid JSON
+        Returns:
+            The parsed result, or None if every attempt failed.
+        '''
+        messages = [{"role": "user", "content": prompt}]
+        for _ in range(self.max_json_retries + 1):
+            response = self.llm_client.call_with_messages_until_json(messages, expect_list=False)
+            try:
+                return parse(response)
+            except (json.JSONDecodeError, AttributeError, IndexError, TypeError) as e:
+                print(f"Invalid JSON response ({e}), retrying: {response[:200]}")
+                # a different conversation, so the cached bad response is not served again
+                messages = messages[:1] + [
+                    {"role": "assistant", "content": response},
+                    {"role": "user", "content": JSON_RETRY_PROMPT},
+                ]
+        print(f"Failed! No valid JSON response for: {prompt[:200]}")
+        return None
 
     def post_process_hierarchical_questions_response(self, response: str, query: str) -> dict:
         '''
@@ -386,6 +713,45 @@ class HierarchicalQuestionTranslator:
             "level_3": result.get("level_3", ""),
         }
     
+    def post_process_hierarchical_batch_response(
+        self, response: str, query_list: List[str]
+    ) -> Dict[int, dict]:
+        '''
+        Postprocess the id-keyed response of a group of queries.
+        Args:
+            response: str
+            query_list: List[str]
+        Returns:
+            Dict[int, dict], the hierarchical questions by 1-based id, leaving out ids that
+            are missing or incomplete
+        '''
+        extractor = JsonStreamExtractor(expect_list=True)
+        if not response or not extractor.feed(response):
+            return {}
+        results = {}
+        for item in extractor.value:
+            if not isinstance(item, dict):
+                continue
+            try:
+                index = int(item.get("id"))
+            except (TypeError, ValueError):
+                continue
+            levels = [item.get(f"level_{level}") for level in (1, 2, 3)]
+            if not 1 <= index <= len(query_list) or not all(
+                isinstance(level, str) and level for level in levels
+            ):
+                continue
+            results.setdefault(
+                index,
+                {
+                    "gql_query": query_list[index - 1],
+                    "level_1": levels[0],
+                    "level_2": levels[1],
+                    "level_3": levels[2],
+                },
+            )
+        return results
+
     def post_process_external_knowledge_response(self, response: str, query: str, hierarchical_question: dict) -> dict:
         '''
         Postprocess the response of external knowledge and add to question samples
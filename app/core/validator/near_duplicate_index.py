@@ -0,0 +1,145 @@
+"""Streaming near-duplicate detection of generated questions.
+
+Every text is reduced to a 64-bit SimHash of its character n-grams. Texts whose
+fingerprints differ in at most max_distance bits are near duplicates. Candidates are
+found by splitting fingerprints into max_distance + 1 blocks: two fingerprints within
+the distance agree on at least one whole block, so only texts sharing a block are
+compared.
+"""
+
+from collections import defaultdict
+import hashlib
+import json
+import os
+import re
+import threading
+from typing import Dict, Iterable, List, Optional
+
+FINGERPRINT_BITS = 64
+
+_NON_WORD = re.compile(r"[^\w]+")
+
+
+class NearDuplicateIndex:
+    """Index of admitted texts that rejects near duplicates of them.
+
+    Args:
+        path: Optional JSONL file the index is loaded from and every admitted text is
+            appended to, so the index spans runs.
+        ngram: Length of the character n-grams the fingerprint is built from.
+        max_distance: Largest number of differing fingerprint bits still counted as a
+            duplicate. 0 only catches texts that are equal after normalization, about
+            3 catches small edits of short questions, larger values get looser.
+    """
+
+    def __init__(self, path: Optional[str] = None, ngram: int = 3, max_distance: int = 3):
+        if not 0 <= max_distance < FINGERPRINT_BITS:
+            raise ValueError(f"max_distance must be in [0, {FINGERPRINT_BITS})")
+        self.path = path
+        self.ngram = ngram
+        self.max_distance = max_distance
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._texts: List[str] = []
+        self._fingerprints: List[int] = []
+        # pigeonhole blocks, every duplicate shares at least one block with its original
+        blocks = max_distance + 1
+        bounds = [FINGERPRINT_BITS * i // blocks for i in range(blocks + 1)]
+        self._blocks = [(low, (1 << (high - low)) - 1) for low, high in zip(bounds, bounds[1:])]
+        self._tables: List[Dict[int, List[int]]] = [defaultdict(list) for _ in self._blocks]
+        if path is not None and os.path.exists(path):
+            self._load(path)
+
+    def _load(self, path: str) -> None:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if "ngram" in entry:
+                    if (entry["ngram"], entry["max_distance"]) != (self.ngram, self.max_distance):
+                        raise ValueError(
+                            f"{path} was built with ngram={entry['ngram']}, "
+                            f"max_distance={entry['max_distance']}"
+                        )
+                    continue
+                self._insert(entry["text"], entry["fingerprint"])
+
+    def __len__(self) -> int:
+        return len(self._texts)
+
+    def normalize(self, text: str) -> str:
+        return " ".join(_NON_WORD.sub(" ", text.lower()).split())
+
+    def fingerprint(self, text: str) -> int:
+        normalized = self.normalize(text)
+        if len(normalized) <= self.ngram:
+            shingles = [normalized]
+        else:
+            shingles = [
+                normalized[i : i + self.ngram] for i in range(len(normalized) - self.ngram + 1)
+            ]
+        weights = [0] * FINGERPRINT_BITS
+        for shingle in shingles:
+            digest = hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest()
+            value = int.from_bytes(digest, "big")
+            for bit in range(FINGERPRINT_BITS):
+                weights[bit] += 1 if value >> bit & 1 else -1
+        return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+    def _find(self, fingerprint: int) -> Optional[int]:
+        # caller holds self._lock
+        for (shift, mask), table in zip(self._blocks, self._tables):
+            for index in table.get(fingerprint >> shift & mask, ()):
+                if (self._fingerprints[index] ^ fingerprint).bit_count() <= self.max_distance:
+                    return index
+        return None
+
+    def _insert(self, text: str, fingerprint: int) -> None:
+        # caller holds self._lock
+        index = len(self._texts)
+        self._texts.append(text)
+        self._fingerprints.append(fingerprint)
+        for (shift, mask), table in zip(self._blocks, self._tables):
+            table[fingerprint >> shift & mask].append(index)
+
+    def find(self, text: str) -> Optional[str]:
+        """Return an admitted text that text is a near duplicate of, or None."""
+        fingerprint = self.fingerprint(text)
+        with self._lock:
+            index = self._find(fingerprint)
+            return None if index is None else self._texts[index]
+
+    def filter(self, texts: Iterable[str]) -> List[str]:
+        """Admit the texts that are not near duplicates, also of each other, and return them."""
+        fingerprinted = [(text, self.fingerprint(text)) for text in texts]
+        admitted = []
+        with self._lock:
+            for text, fingerprint in fingerprinted:
+                if self._find(fingerprint) is not None:
+                    self.rejected += 1
+                    continue
+                self._insert(text, fingerprint)
+                admitted.append((text, fingerprint))
+            if self.path is not None and admitted:
+                self._append(admitted)
+        return [text for text, _ in admitted]
+
+    def admit(self, text: str) -> bool:
+        """Add text unless it is a near duplicate, returning whether it was added."""
+        return bool(self.filter([text]))
+
+    def _append(self, admitted) -> None:
+        # caller holds self._lock
+        new_file = not os.path.exists(self.path)
+        with open(self.path, "a", encoding="utf-8") as f:
+            if new_file:
+                f.write(json.dumps({"ngram": self.ngram, "max_distance": self.max_distance}))
+                f.write("\n")
+            for text, fingerprint in admitted:
+                entry = {"fingerprint": fingerprint, "text": text}
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._texts), "rejected": self.rejected}
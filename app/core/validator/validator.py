@@ -1,5 +1,5 @@
 import logging
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 
 from app.core.validator.db_client import DB_Client, QueryResult, QueryStatus
 from app.impl.tugraph_cypher.db_client.tugraph_db_client import TuGraphDBClient
@@ -39,38 +39,41 @@ class CorpusValidator:
 
         print("\n--- Validating generated pairs against the database ---")
         valid_pairs = []
-        valid_num = 0
-
-        valid_pairs = []
-        valid_num = 0
         for pair in pairs:
-            question = pair.get("question")
-            query = pair.get("query")
+            valid_pair = self.validate_pair(pair)
+            if valid_pair is not None:
+                valid_pairs.append(valid_pair)
+
+        logger.info(f"{len(valid_pairs)}/{len(pairs)} pairs had successful query results. ")
+        return valid_pairs
+
+    def validate_pair(self, pair: Dict[str, str]) -> Optional[Dict[str, Any]]:
+        """
+        Execute the query of one pair and return it with a result summary,
+        or None if the pair is invalid, fails execution or has empty results.
+        """
+        client = self._get_client()
+        question = pair.get("question")
+        query = pair.get("query")
 
-            if not question or not query:
-                logger.warning(f"Invalid pair found (missing keys): {pair}")
-                continue
+        if not question or not query:
+            logger.warning(f"Invalid pair found (missing keys): {pair}")
+            return None
 
-            # 1. execute query
-            result: QueryResult = client.execute_query(pair["query"])
+        # 1. execute query
+        result: QueryResult = client.execute_query(pair["query"])
 
-            if result.status_code == QueryStatus.SUCCESS:
-                # Successfully obtained data
-                if len(str(result.data)) > 500:
-                    res_summary = str(result.data)[:500] + "..."
-                else:
-                    res_summary = str(result.data)
-                valid_pairs.append(
-                    {"question": pair["question"], "query": pair["query"], "result": res_summary}
-                )
-                valid_num += 1
+        if result.status_code == QueryStatus.SUCCESS:
+            # Successfully obtained data
+            if len(str(result.data)) > 500:
+                res_summary = str(result.data)[:500] + "..."
             else:
-                # Query failed or no records, skip directly (continue)
-                logger.warning(
-                    f"Skipping pair due to non-successful result "
-                    f"(Code {result.status_code}): {pair['question']}"
-                )
-                continue
-
-        logger.info(f"{valid_num}/{len(pairs)} pairs had successful query results. ")
-        return valid_pairs
+                res_summary = str(result.data)
+            return {"question": pair["question"], "query": pair["query"], "result": res_summary}
+        else:
+            # Query failed or no records, skip directly
+            logger.warning(
+                f"Skipping pair due to non-successful result "
+                f"(Code {result.status_code}): {pair['question']}"
+            )
+            return None
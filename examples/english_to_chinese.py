@@ -1,5 +1,6 @@
 import pandas as pd
 
+from app.core.llm.llm_cache import LlmCache
 from app.core.llm.llm_client import LlmClient
 from app.core.translator.question_translator import QuestionTranslator
 from app.impl.iso_gql.translator.iso_gql_query_translator import (
@@ -40,8 +41,8 @@ for _, row in df.iterrows():
 source_language = "English"
 target_language = "Chinese"
 
-llm_client = LlmClient(model="qwen-plus-0723")
-question_translator = QuestionTranslator(llm_client=llm_client, chunk_size=100)
+llm_client = LlmClient(model="qwen-plus-0723", cache=LlmCache("./.llm_cache.sqlite"))
+question_translator = QuestionTranslator(llm_client=llm_client, chunk_size=100, max_concurrency=20)
 
 question_list = new_df["question"].to_list()
 query_list = new_df["gql"].to_list()
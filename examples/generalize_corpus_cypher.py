@@ -49,10 +49,12 @@ for i in range(len(query_list)):
 # generalize question
 generalized_corpus_pair_list = []
 question_generalizer = QuestionGeneralizer(llm_client)
-for corpus_pair in corpus_pair_list:
+generalized_question_lists = question_generalizer.generalize_batch(
+    [(corpus_pair[0], corpus_pair[1]) for corpus_pair in corpus_pair_list], per_item=10
+)
+for corpus_pair, generalized_question_list in zip(corpus_pair_list, generalized_question_lists):
     query = corpus_pair[0]
     question = corpus_pair[1]
-    generalized_question_list = question_generalizer.generalize(query=query, question=question)
     for generalized_question in generalized_question_list:
         generalized_corpus_pair_list.append((query, generalized_question))
     generalized_corpus_pair_list.append((query, question))
@@ -2,8 +2,11 @@ import json
 import logging
 from pathlib import Path
 
+from app.core.generator.context_selector import ContextSelector
 from app.core.generator.corpus_generator import CorpusGenerator
+from app.core.llm.llm_cache import LlmCache
 from app.core.llm.llm_client import LlmClient
+from app.core.validator.near_duplicate_index import NearDuplicateIndex
 from app.core.validator.validator import CorpusValidator
 
 # Configure logging
@@ -80,10 +83,13 @@ def main():
             {"question": "Seed 2", "query": "MATCH p = ()-[]-()-[]-() RETURN p LIMIT 5"},
         ]
 
-        llm_client = LlmClient(model="qwen3-coder-plus-2025-07-22")
+        llm_cache = LlmCache("examples/generated_corpus/.llm_cache.sqlite")
+        llm_client = LlmClient(model="qwen3-coder-plus-2025-07-22", cache=llm_cache)
 
         # Initialize the generator and validator with their respective clients
-        generator = CorpusGenerator(llm_client=llm_client)
+        # near-duplicate questions are dropped before validation, across runs
+        dedup_index = NearDuplicateIndex("examples/generated_corpus/.question_index.jsonl")
+        generator = CorpusGenerator(llm_client=llm_client, dedup_index=dedup_index)
         validator = CorpusValidator(tu_client_params=tu_client_params)
 
         target_seeds_size = 30
@@ -101,24 +107,16 @@ def main():
             logger.info("`seeds_json_path` is empty. Generating new seeds from scratch...")
             seed_context = validator.execute_with_results(explore_query)
 
-            # Generation loop for seeds
-            while len(seeds_corpus) < target_seeds_size:
-                logger.info(
-                    f"Current seeds count: {len(seeds_corpus)}. "
-                    f"Target: {target_seeds_size}. Generating more..."
-                )
-                # 1. Generate a batch of seeds
-                seed_context = seed_context + seeds_corpus
-                tmp_seeds_corpus = generator.generate_seeds_corpus(
-                    seed_context,
-                    target_seeds_size,
-                    schema_json,
-                    questions_per_call,
-                )
-                # 2. Validate the batch and add valid pairs to the main list
-                validated_seeds_with_context = validator.execute_with_results(tmp_seeds_corpus)
-                seeds_corpus.extend(validated_seeds_with_context)
-                logger.info(f"Added {len(validated_seeds_with_context)} new valid seeds.")
+            # Translation and validation run concurrently with the brainstorming, only
+            # pairs whose query executes successfully count towards the target
+            seeds_corpus = generator.generate_seeds_corpus(
+                seed_context,
+                target_seeds_size,
+                schema_json,
+                questions_per_call,
+                validator=validator,
+            )
+            logger.info(f"Generated {len(seeds_corpus)} valid seeds.")
 
             # Save the newly generated seeds corpus
             save_corpus_without_results(seeds_corpus, seeds_path)
@@ -158,6 +156,9 @@ def main():
         for batch_number in range(iteration_times):
             logger.info(f"--- Starting Iteration Batch {batch_number + 1}/{iteration_times} ---")
             iteration_pairs = []
+            # Sample the seeds of this batch once, every call draws its examples from it
+            context_selector = ContextSelector(count_tokens=llm_client.count_tokens)
+            context_selector.add_many(current_seeds)
 
             # Inner while loop to ensure enough corpus is generated for the current batch
             while len(iteration_pairs) < corpus_size_per_iteration:
@@ -172,11 +173,14 @@ def main():
                 raw_corpus = generator.run_generation_loop(
                     schema_json=schema_json,
                     seeds_corpus_with_context=current_seeds,
+                    context_selector=context_selector,
                     complexity_corpus_size=num_per_llm_call,
                 )
 
                 # 1. Execute query and get context (assuming this function exists)
                 pairs_with_context = validator.execute_with_results(raw_corpus)
+                # Only validated questions enter the near-duplicate index
+                pairs_with_context = generator.admit_pairs(pairs_with_context)
 
                 iteration_pairs.extend(pairs_with_context)
 
@@ -203,6 +207,8 @@ def main():
                 break
 
         logger.info("Corpus generation complete! Individual batch files have been saved.")
+        logger.info(f"LLM cache stats: {llm_cache.stats()}")
+        logger.info(f"Near-duplicate index stats: {dedup_index.stats()}")
 
     except Exception as e:
         logger.error(f"Program execution failed: {str(e)}", exc_info=True)
@@ -3,6 +3,7 @@ import logging
 import os
 from pathlib import Path
 
+from app.core.llm.llm_cache import LlmCache
 from app.core.llm.llm_client import LlmClient
 from app.core.translator.query_grader import QueryGrader
 
@@ -20,7 +21,8 @@ def main():
         # Configuration
         input_file_path = "examples/generated_corpus/example_corpus.json"
         model_name = "qwen3-coder-plus-2025-07-22"
-        llm_client = LlmClient(model=model_name)
+        llm_cache = LlmCache("examples/generated_corpus/.llm_cache.sqlite")
+        llm_client = LlmClient(model=model_name, cache=llm_cache)
         batch_size = 10
         concurrent = 5
 
@@ -67,6 +69,7 @@ def main():
             diff = item.get("difficulty", "unknown")
             difficulty_counts[diff] = difficulty_counts.get(diff, 0) + 1
 
+        logger.info(f"LLM cache stats: {llm_cache.stats()}")
         logger.info("Grading Summary:")
         for diff in order:
             count = difficulty_counts[diff]
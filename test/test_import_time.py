@@ -0,0 +1,61 @@
+"""Guards against heavy LLM backends being imported at module load.
+
+Backends are imported lazily on first use, so remote-only runs never pay for importing
+torch or transformers.
+"""
+
+from pathlib import Path
+import subprocess
+import sys
+
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+
+HEAVY_MODULES = ["torch", "transformers", "openai", "dashscope", "httpx"]
+
+MODULES = [
+    "app.core.llm.llm_client",
+    "app.core.translator.question_translator",
+    "app.core.translator.query_grader",
+    "app.core.generalizer.question_generalizer",
+    "app.core.generator.corpus_generator",
+]
+
+CHECK_SCRIPT = """
+import sys
+import {module}
+print(",".join(name for name in {heavy!r} if name in sys.modules))
+"""
+
+
+def imported_packages(importtime_output: str):
+    """Top-level package names listed by python -X importtime."""
+    packages = set()
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:") or line.count("|") < 2:
+            continue
+        name = line.rsplit("|", 1)[1].strip()
+        packages.add(name.split(".")[0])
+    return packages
+
+
+@pytest.mark.parametrize("module", MODULES)
+def test_import_does_not_load_llm_backends(module):
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-X",
+            "importtime",
+            "-c",
+            CHECK_SCRIPT.format(module=module, heavy=HEAVY_MODULES),
+        ],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 0, result.stderr[-2000:]
+
+    loaded = [name for name in result.stdout.strip().split(",") if name]
+    assert loaded == [], f"importing {module} loaded {loaded}"
+    assert not imported_packages(result.stderr) & set(HEAVY_MODULES)